@@ -0,0 +1,169 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# GAE benchmark, the per-step loop against the log-depth scan on random rollouts.
+#
+#   python benchmarks/gae_benchmark.py --device cuda:0 --horizons 16 32 64 128 256 512 --num_envs 4096
+#
+# Results are written as JSON to benchmarks/results/ unless --output is given.
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from learning.gae import compute_gae_loop, compute_gae_scan
+
+
+def sync(device):
+    if (torch.device(device).type == "cuda"):
+        torch.cuda.synchronize(device)
+    return
+
+
+def time_op(fn, device, warmup, iters):
+    for i in range(warmup):
+        fn()
+    sync(device)
+
+    times = []
+    for i in range(iters):
+        start = time.perf_counter()
+        fn()
+        sync(device)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def summarize(times):
+    times = np.array(times)
+    return {
+        "mean_ms": 1000.0 * float(np.mean(times)),
+        "std_ms": 1000.0 * float(np.std(times)),
+        "min_ms": 1000.0 * float(np.min(times)),
+        "iters": int(times.shape[0]),
+    }
+
+
+def build_rollout(horizon_length, num_envs, done_prob, terminate_prob, device):
+    # next values are masked by terminate the same way play_steps does
+    fdones = (torch.rand((horizon_length, num_envs), device=device) < done_prob).float()
+    terminated = (torch.rand((horizon_length, num_envs, 1), device=device) < terminate_prob).float()
+    terminated *= fdones.unsqueeze(-1)
+    values = torch.randn((horizon_length, num_envs, 1), device=device)
+    rewards = torch.rand((horizon_length, num_envs, 1), device=device)
+    next_values = torch.randn((horizon_length, num_envs, 1), device=device) * (1.0 - terminated)
+    return fdones, values, rewards, next_values
+
+
+def run_horizon(args, horizon_length):
+    device = args.device
+    fdones, values, rewards, next_values = build_rollout(horizon_length, args.num_envs, args.done_prob,
+                                                         args.terminate_prob, device)
+
+    loop_fn = lambda: compute_gae_loop(fdones, values, rewards, next_values, args.gamma, args.tau)
+    scan_fn = lambda: compute_gae_scan(fdones, values, rewards, next_values, args.gamma, args.tau)
+
+    loop_advs = loop_fn()
+    scan_advs = scan_fn()
+    max_abs_err = float(torch.max(torch.abs(loop_advs - scan_advs)))
+    max_rel_err = float(torch.max(torch.abs(loop_advs - scan_advs) / (torch.abs(loop_advs) + 1e-6)))
+
+    results = []
+    for name, fn in (("loop", loop_fn), ("scan", scan_fn)):
+        entry = {"horizon_length": horizon_length, "num_envs": args.num_envs, "impl": name,
+                 "max_abs_err": max_abs_err, "max_rel_err": max_rel_err}
+        entry.update(summarize(time_op(fn, device, args.warmup, args.iters)))
+        results.append(entry)
+        print("horizon={:4d} envs={:6d} {:4s} {:9.3f} ms  max_abs_err={:.3e}".format(
+            horizon_length, args.num_envs, name, entry["mean_ms"], max_abs_err))
+
+    assert max_abs_err <= args.tolerance * (1.0 + float(torch.max(torch.abs(loop_advs)))), \
+        "scan deviates from the loop by {:.3e} at horizon {:d}".format(max_abs_err, horizon_length)
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="GAE loop vs scan benchmark on random rollouts")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--horizons", type=int, nargs="+", default=[16, 32, 64, 128, 256, 512])
+    parser.add_argument("--num_envs", type=int, default=4096)
+    parser.add_argument("--gamma", type=float, default=0.99)
+    parser.add_argument("--tau", type=float, default=0.95)
+    parser.add_argument("--done_prob", type=float, default=0.01)
+    parser.add_argument("--terminate_prob", type=float, default=0.5)
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    results = []
+    for horizon_length in args.horizons:
+        results += run_horizon(args, horizon_length)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    output = args.output
+    if (output is None):
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                              "gae_{:s}.json".format(timestamp))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    report = {
+        "benchmark": "gae",
+        "timestamp": timestamp,
+        "torch_version": torch.__version__,
+        "device": args.device,
+        "args": vars(args),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Wrote {:d} results to {:s}".format(len(results), output))
+
+    return
+
+
+if __name__ == "__main__":
+    main()
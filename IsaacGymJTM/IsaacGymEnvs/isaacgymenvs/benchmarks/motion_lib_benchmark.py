@@ -0,0 +1,336 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# MotionLib micro-benchmarks on synthetic clips, no assets or GPU required.
+#
+#   python benchmarks/motion_lib_benchmark.py --device cpu --num_clips 1 16 --clip_frames 60 300
+#
+# Results are written as JSON to benchmarks/results/ unless --output is given.
+
+import isaacgym
+
+import argparse
+import datetime
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tasks.amp.poselib.poselib.skeleton.skeleton3d import SkeletonTree, SkeletonState, SkeletonMotion
+from tasks.amp.utils_amp.motion_lib import MotionLib
+from tasks.atlas_amp import build_amp_observations as build_atlas_amp_observations
+from tasks.common_rig_amp import build_amp_observations as build_common_rig_amp_observations
+
+
+SKELETONS = {
+    # 31 bodies, every joint a hinge
+    "atlas": {
+        "num_bodies": 31,
+        "dof_body_ids": list(range(1, 31)),
+        "dof_offsets": list(range(0, 31)),
+        "key_body_ids": [10, 16, 23, 30],
+        "build_amp_obs": build_atlas_amp_observations,
+    },
+    # 19 bodies, mix of spherical (rpy) and hinge joints
+    "common_rig": {
+        "num_bodies": 19,
+        "dof_body_ids": [1, 2, 4, 5, 6, 7, 8, 9, 10, 12, 13, 14, 16, 17, 18],
+        "dof_offsets": [0, 3, 4, 7, 8, 11, 14, 15, 18, 21, 24, 25, 28, 31, 32, 35],
+        "key_body_ids": [6, 10, 14, 18],
+        "build_amp_obs": build_common_rig_amp_observations,
+    },
+}
+
+FPS = 30
+
+
+def build_skeleton_tree(num_bodies, rng):
+    node_names = ["body_{:d}".format(i) for i in range(num_bodies)]
+    parent_indices = torch.tensor([-1] + [(i - 1) // 2 for i in range(1, num_bodies)], dtype=torch.int32)
+    local_translation = torch.tensor(rng.uniform(-0.2, 0.2, size=(num_bodies, 3)), dtype=torch.float)
+    return SkeletonTree(node_names, parent_indices, local_translation)
+
+
+def build_synthetic_motion(skeleton_tree, num_dofs, num_frames, rng):
+    num_bodies = len(skeleton_tree)
+    t = np.arange(num_frames) / FPS
+
+    # smooth per-joint rotations about fixed random axes
+    axis = rng.normal(size=(num_bodies, 3))
+    axis /= np.linalg.norm(axis, axis=-1, keepdims=True)
+    freq = rng.uniform(0.5, 2.0, size=num_bodies)
+    phase = rng.uniform(0.0, 2.0 * np.pi, size=num_bodies)
+    angle = 0.3 * np.sin(2.0 * np.pi * freq[None, :] * t[:, None] + phase[None, :])
+    rot = np.concatenate([axis[None] * np.sin(0.5 * angle)[..., None], np.cos(0.5 * angle)[..., None]], axis=-1)
+    rot = torch.tensor(rot, dtype=torch.float)
+
+    root_trans = np.stack([1.0 * t, np.zeros_like(t), 0.9 + 0.02 * np.sin(4.0 * np.pi * t)], axis=-1)
+    root_trans = torch.tensor(root_trans, dtype=torch.float)
+
+    q_freq = rng.uniform(0.5, 2.0, size=num_dofs)
+    q_phase = rng.uniform(0.0, 2.0 * np.pi, size=num_dofs)
+    q_pos = 0.5 * np.sin(2.0 * np.pi * q_freq[None, :] * t[:, None] + q_phase[None, :])
+
+    state = SkeletonState.from_rotation_and_root_translation(skeleton_tree, rot, root_trans, is_local=True)
+    vel = SkeletonMotion._compute_velocity(state.global_translation, 1.0 / FPS)
+    ang_vel = SkeletonMotion._compute_angular_velocity(state.global_rotation, 1.0 / FPS)
+    motion = SkeletonMotion(SkeletonMotion._to_state_vector(rot, root_trans, vel, ang_vel),
+                            skeleton_tree=skeleton_tree, is_local=True, fps=FPS, q_pos=q_pos)
+    return motion
+
+
+def write_dataset(out_dir, skeleton, num_clips, num_frames, seed):
+    # SkeletonMotion.to_dict does not carry q_pos, add it the way the retargeted files do
+    rng = np.random.RandomState(seed)
+    spec = SKELETONS[skeleton]
+    skeleton_tree = build_skeleton_tree(spec["num_bodies"], rng)
+    num_dofs = spec["dof_offsets"][-1]
+
+    motions = []
+    for i in range(num_clips):
+        motion = build_synthetic_motion(skeleton_tree, num_dofs, num_frames, rng)
+        motion_dict = motion.to_dict()
+        motion_dict["q_pos"] = motion.q_pos
+        file_name = "clip_{:04d}.npy".format(i)
+        np.save(os.path.join(out_dir, file_name), motion_dict)
+        motions.append({"file": file_name, "weight": float(rng.uniform(0.5, 1.5))})
+
+    motion_file = os.path.join(out_dir, "dataset.yaml")
+    with open(motion_file, "w") as f:
+        yaml.dump({"motions": motions}, f)
+
+    return motion_file
+
+
+def sync(device):
+    if (torch.device(device).type == "cuda"):
+        torch.cuda.synchronize(device)
+    return
+
+
+def reset_peak_memory(device):
+    if (torch.device(device).type == "cuda"):
+        torch.cuda.reset_peak_memory_stats(device)
+    return
+
+
+def peak_memory(device):
+    mem = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}
+    if (torch.device(device).type == "cuda"):
+        mem["peak_cuda_mb"] = torch.cuda.max_memory_allocated(device) / (1024.0 * 1024.0)
+    return mem
+
+
+def time_op(fn, device, warmup, iters):
+    for i in range(warmup):
+        fn()
+    sync(device)
+
+    times = []
+    for i in range(iters):
+        start = time.perf_counter()
+        fn()
+        sync(device)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def summarize(times, num_items):
+    times = np.array(times)
+    mean = float(np.mean(times))
+    return {
+        "mean_ms": 1000.0 * mean,
+        "std_ms": 1000.0 * float(np.std(times)),
+        "min_ms": 1000.0 * float(np.min(times)),
+        "iters": int(times.shape[0]),
+        "throughput": num_items / mean if mean > 0.0 else float("inf"),
+    }
+
+
+def make_amp_obs_fn(skeleton):
+    # the task's own AMP observations, localRootObs as in the task configs
+    build_amp_obs = SKELETONS[skeleton]["build_amp_obs"]
+    def amp_obs_fn(root_states, dof_pos, dof_vel, key_pos):
+        return build_amp_obs(root_states, dof_pos, dof_vel, key_pos, False)
+    return amp_obs_fn
+
+
+def build_motion_lib(motion_file, skeleton, mode, device):
+    spec = SKELETONS[skeleton]
+    motion_lib = MotionLib(motion_file=motion_file,
+                           num_dofs=spec["dof_offsets"][-1],
+                           key_body_ids=np.array(spec["key_body_ids"]),
+                           device=device,
+                           packed=(mode != "legacy"),
+                           dof_body_ids=spec["dof_body_ids"],
+                           dof_offsets=spec["dof_offsets"])
+    if (mode == "table"):
+        motion_lib.build_amp_obs_table(make_amp_obs_fn(skeleton))
+    return motion_lib
+
+
+def run_config(args, motion_file, skeleton, num_clips, num_frames, mode):
+    device = args.device
+    config = {"skeleton": skeleton, "num_clips": num_clips, "clip_frames": num_frames, "mode": mode}
+    results = []
+
+    def record(op, batch_size, times):
+        entry = dict(config)
+        entry["op"] = op
+        entry["batch_size"] = batch_size
+        entry.update(summarize(times, batch_size))
+        entry.update(peak_memory(device))
+        results.append(entry)
+        print("{:10s} {:6s} clips={:4d} frames={:5d} {:22s} n={:6d} {:9.3f} ms".format(
+            skeleton, mode, num_clips, num_frames, op, batch_size, entry["mean_ms"]))
+        return
+
+    reset_peak_memory(device)
+    load_times = []
+    for i in range(args.load_iters):
+        start = time.perf_counter()
+        motion_lib = build_motion_lib(motion_file, skeleton, mode, device)
+        sync(device)
+        load_times.append(time.perf_counter() - start)
+    record("load", num_clips, load_times)
+
+    dt = 1.0 / FPS
+    num_steps = args.amp_obs_steps
+    time_steps = -dt * torch.arange(0, num_steps, device=device, dtype=torch.float)
+    amp_obs_fn = make_amp_obs_fn(skeleton)
+
+    def demo_window(ids, times):
+        # what the tasks do for a demo window without a table
+        root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos \
+               = motion_lib.get_motion_state(ids, times)
+        root_states = torch.cat([root_pos, root_rot, root_vel, root_ang_vel], dim=-1)
+        return amp_obs_fn(root_states, dof_pos, dof_vel, key_pos)
+
+    for batch_size in args.batch_sizes:
+        host_ids = motion_lib.sample_motions(batch_size)
+        host_times = motion_lib.sample_time(host_ids)
+        ids = motion_lib.sample_motions_tensor(batch_size)
+        times = motion_lib.sample_time_tensor(ids)
+
+        window_ids = ids.unsqueeze(-1).expand(-1, num_steps).flatten()
+        window_times = (times.unsqueeze(-1) + time_steps).flatten()
+
+        reset_peak_memory(device)
+        record("sample_motions", batch_size,
+               time_op(lambda: motion_lib.sample_motions(batch_size), device, args.warmup, args.iters))
+        record("sample_time", batch_size,
+               time_op(lambda: motion_lib.sample_time(host_ids), device, args.warmup, args.iters))
+        record("sample_motions_tensor", batch_size,
+               time_op(lambda: motion_lib.sample_motions_tensor(batch_size), device, args.warmup, args.iters))
+        record("sample_time_tensor", batch_size,
+               time_op(lambda: motion_lib.sample_time_tensor(ids), device, args.warmup, args.iters))
+
+        reset_peak_memory(device)
+        record("get_motion_state", batch_size,
+               time_op(lambda: motion_lib.get_motion_state(ids, times), device, args.warmup, args.iters))
+        record("get_motion_state_host_ids", batch_size,
+               time_op(lambda: motion_lib.get_motion_state(host_ids, host_times), device, args.warmup, args.iters))
+
+        reset_peak_memory(device)
+        if (mode == "table"):
+            window_fn = lambda: motion_lib.get_amp_obs(window_ids, window_times)
+        else:
+            window_fn = lambda: demo_window(window_ids, window_times)
+        record("amp_demo_window", batch_size, time_op(window_fn, device, args.warmup, args.iters))
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MotionLib micro-benchmarks on synthetic clips")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--skeletons", type=str, nargs="+", default=list(SKELETONS.keys()), choices=list(SKELETONS.keys()))
+    parser.add_argument("--modes", type=str, nargs="+", default=["legacy", "packed", "table"],
+                        choices=["legacy", "packed", "table"])
+    parser.add_argument("--num_clips", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--clip_frames", type=int, nargs="+", default=[60, 300, 1200])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--amp_obs_steps", type=int, default=2)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--load_iters", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        for skeleton in args.skeletons:
+            for num_clips in args.num_clips:
+                for num_frames in args.clip_frames:
+                    dataset_dir = os.path.join(data_dir, "{:s}_{:d}_{:d}".format(skeleton, num_clips, num_frames))
+                    os.makedirs(dataset_dir)
+                    motion_file = write_dataset(dataset_dir, skeleton, num_clips, num_frames, args.seed)
+
+                    for mode in args.modes:
+                        results += run_config(args, motion_file, skeleton, num_clips, num_frames, mode)
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    output = args.output
+    if (output is None):
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                              "motion_lib_{:s}.json".format(timestamp))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    report = {
+        "benchmark": "motion_lib",
+        "timestamp": timestamp,
+        "torch_version": torch.__version__,
+        "device": args.device,
+        "args": vars(args),
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Wrote {:d} results to {:s}".format(len(results), output))
+
+    return
+
+
+if __name__ == "__main__":
+    main()
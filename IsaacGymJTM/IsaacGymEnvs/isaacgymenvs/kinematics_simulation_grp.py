@@ -133,7 +133,8 @@ body_ids = to_torch(body_ids, device=device, dtype=torch.long)
 motion_lib = MotionLib(motion_file=motion_file_path, 
                                 num_dofs=num_dof,
                                 key_body_ids=body_ids.cpu().numpy(),
-                                device=device)
+                                device=device,
+                                grp_bank_file=sampled_motion_path)
 motion_ids = motion_lib.sample_motions(1)
 motion_times = 0
 dof_state_tensor = gym.acquire_dof_state_tensor(sim)
@@ -42,6 +42,7 @@ import torch
 from torch import nn
 
 import learning.replay_buffer as replay_buffer
+import learning.amp_demo_producer as amp_demo_producer
 import learning.common_agent as common_agent 
 
 from tensorboardX import SummaryWriter
@@ -60,6 +61,12 @@ class AMPAgent(common_agent.CommonAgent):
         super().init_tensors()
         self._build_amp_buffers()
         return
+
+    def train(self):
+        try:
+            return super().train()
+        finally:
+            self._close_amp_demo_producer()
     
     def set_eval(self):
         super().set_eval()
@@ -99,7 +106,8 @@ class AMPAgent(common_agent.CommonAgent):
                 masks = self.vec_env.get_action_masks()
                 res_dict = self.get_masked_action_values(self.obs, masks)
             else:
-                res_dict = self.get_action_values(self.obs)
+                with self.profiler.scope("policy_inference"):
+                    res_dict = self.get_action_values(self.obs)
 
             for k in update_list:
                 self.experience_buffer.update_data(k, n, res_dict[k]) 
@@ -107,7 +115,8 @@ class AMPAgent(common_agent.CommonAgent):
             if self.has_central_value:
                 self.experience_buffer.update_data('states', n, self.obs['states'])
 
-            self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
+            with self.profiler.scope("env_step"):
+                self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
             shaped_rewards = self.rewards_shaper(rewards)
             self.experience_buffer.update_data('rewards', n, shaped_rewards)
             self.experience_buffer.update_data('next_obses', n, self.obs['obs'])
@@ -116,7 +125,8 @@ class AMPAgent(common_agent.CommonAgent):
 
             terminated = infos['terminate'].float()
             terminated = terminated.unsqueeze(-1)
-            next_vals = self._eval_critic(self.obs)
+            with self.profiler.scope("critic"):
+                next_vals = self._eval_critic(self.obs)
             next_vals *= (1.0 - terminated)
             self.experience_buffer.update_data('next_values', n, next_vals)
 
@@ -143,10 +153,12 @@ class AMPAgent(common_agent.CommonAgent):
 
         mb_rewards = self.experience_buffer.tensor_dict['rewards']
         mb_amp_obs = self.experience_buffer.tensor_dict['amp_obs']
-        amp_rewards = self._calc_amp_rewards(mb_amp_obs)
-        mb_rewards = self._combine_rewards(mb_rewards, amp_rewards)
+        with self.profiler.scope("amp_rewards"):
+            amp_rewards = self._calc_amp_rewards(mb_amp_obs)
+            mb_rewards = self._combine_rewards(mb_rewards, amp_rewards)
 
-        mb_advs = self.discount_values(mb_fdones, mb_values, mb_rewards, mb_next_values)
+        with self.profiler.scope("discount_values"):
+            mb_advs = self.discount_values(mb_fdones, mb_values, mb_rewards, mb_next_values)
         mb_returns = mb_advs + mb_values
 
         batch_dict = self.experience_buffer.get_transformed_list(a2c_common.swap_and_flatten01, self.tensor_list)
@@ -163,6 +175,7 @@ class AMPAgent(common_agent.CommonAgent):
         self.dataset.values_dict['amp_obs'] = batch_dict['amp_obs']
         self.dataset.values_dict['amp_obs_demo'] = batch_dict['amp_obs_demo']
         self.dataset.values_dict['amp_obs_replay'] = batch_dict['amp_obs_replay']
+        self.dataset.values_dict['amp_obs_replay_idx'] = batch_dict.get('amp_obs_replay_idx', None)
         return
 
     def train_epoch(self):
@@ -177,7 +190,8 @@ class AMPAgent(common_agent.CommonAgent):
         update_time_start = time.time()
         rnn_masks = batch_dict.get('rnn_masks', None)
         
-        self._update_amp_demos()
+        with self.profiler.scope("update_amp_demos"):
+            self._update_amp_demos()
         num_obs_samples = batch_dict['amp_obs'].shape[0]
         amp_obs_demo = self._amp_obs_demo_buffer.sample(num_obs_samples)['amp_obs']
         batch_dict['amp_obs_demo'] = amp_obs_demo
@@ -185,7 +199,10 @@ class AMPAgent(common_agent.CommonAgent):
         if (self._amp_replay_buffer.get_total_count() == 0):
             batch_dict['amp_obs_replay'] = batch_dict['amp_obs']
         else:
-            batch_dict['amp_obs_replay'] = self._amp_replay_buffer.sample(num_obs_samples)['amp_obs']
+            replay_samples = self._amp_replay_buffer.sample(num_obs_samples)
+            batch_dict['amp_obs_replay'] = replay_samples['amp_obs']
+            if (self._amp_replay_prioritized):
+                batch_dict['amp_obs_replay_idx'] = replay_samples['idx']
 
         self.set_train()
 
@@ -205,7 +222,8 @@ class AMPAgent(common_agent.CommonAgent):
         for _ in range(0, self.mini_epochs_num):
             ep_kls = []
             for i in range(len(self.dataset)):
-                curr_train_info = self.train_actor_critic(self.dataset[i])
+                with self.profiler.scope("train_actor_critic"):
+                    curr_train_info = self.train_actor_critic(self.dataset[i])
                 
                 if self.schedule_type == 'legacy':  
                     if self.multi_gpu:
@@ -317,6 +335,11 @@ class AMPAgent(common_agent.CommonAgent):
             disc_info = self._disc_loss(disc_agent_cat_logit, disc_demo_logit, amp_obs_demo)
             disc_loss = disc_info['disc_loss']
 
+            if ('amp_obs_replay_idx' in input_dict):
+                replay_idx = input_dict['amp_obs_replay_idx'][0:self._amp_minibatch_size]
+                replay_logit = disc_info['disc_agent_logit'][disc_agent_logit.shape[0]:]
+                self._amp_replay_buffer.update_priorities(replay_idx, replay_logit)
+
             loss = a_loss + self.critic_coef * c_loss - self.entropy_coef * entropy + self.bounds_loss_coef * b_loss \
                  + self._disc_coef * disc_loss
             
@@ -459,26 +482,69 @@ class AMPAgent(common_agent.CommonAgent):
                                                                     device=self.ppo_device)
         
         amp_obs_demo_buffer_size = int(self.config['amp_obs_demo_buffer_size'])
-        self._amp_obs_demo_buffer = replay_buffer.ReplayBuffer(amp_obs_demo_buffer_size, self.ppo_device)
+        amp_obs_demo_storage = self.config.get('amp_obs_demo_storage', 'float32')
+        self._amp_obs_demo_buffer = replay_buffer.ReplayBuffer(amp_obs_demo_buffer_size, self.ppo_device,
+                                                               storage_dtype=amp_obs_demo_storage)
 
         self._amp_replay_keep_prob = self.config['amp_replay_keep_prob']
         replay_buffer_size = int(self.config['amp_replay_buffer_size'])
-        self._amp_replay_buffer = replay_buffer.ReplayBuffer(replay_buffer_size, self.ppo_device)
+        amp_replay_storage = self.config.get('amp_replay_storage', 'float32')
+        self._amp_replay_reservoir = self.config.get('amp_replay_reservoir', False)
+        self._amp_replay_prioritized = self.config.get('amp_replay_prioritized', False)
+        if (self._amp_replay_reservoir or self._amp_replay_prioritized):
+            self._amp_replay_buffer = replay_buffer.ReservoirReplayBuffer(replay_buffer_size, self.ppo_device,
+                                                                          storage_dtype=amp_replay_storage,
+                                                                          prioritized=self._amp_replay_prioritized,
+                                                                          priority_alpha=self.config.get('amp_replay_priority_alpha', 0.6))
+        else:
+            self._amp_replay_buffer = replay_buffer.ReplayBuffer(replay_buffer_size, self.ppo_device,
+                                                                 storage_dtype=amp_replay_storage)
 
         self.tensor_list += ['amp_obs']
         return
 
     def _init_amp_demo_buf(self):
+        # a producer from an earlier init would keep writing into the old buffer
+        self._close_amp_demo_producer()
+
         buffer_size = self._amp_obs_demo_buffer.get_buffer_size()
-        num_batches = int(np.ceil(buffer_size / self._amp_batch_size))
 
-        for i in range(num_batches):
-            curr_samples = self._fetch_amp_obs_demo(self._amp_batch_size)
-            self._amp_obs_demo_buffer.store({'amp_obs': curr_samples})
+        fetch_bulk = getattr(self.vec_env.env, 'fetch_amp_obs_demo_bulk', None)
+        if (self.config.get('amp_demo_bulk_init', True) and fetch_bulk is not None):
+            self._amp_obs_demo_buffer.store({'amp_obs': fetch_bulk(buffer_size)})
+        else:
+            num_batches = int(np.ceil(buffer_size / self._amp_batch_size))
+            for i in range(num_batches):
+                curr_samples = self._fetch_amp_obs_demo(self._amp_batch_size)
+                self._amp_obs_demo_buffer.store({'amp_obs': curr_samples})
+
+        # the producer only starts once the buffer is filled and samples through its own fetch,
+        # which neither shares the task's demo buffer nor its generator
+        amp_demo_prefetch = self.config.get('amp_demo_prefetch', 0)
+        if (amp_demo_prefetch > 0):
+            build_fetch = getattr(self.vec_env.env, 'build_async_amp_demo_fetch', None)
+            fetch_fn = build_fetch() if build_fetch is not None else None
+            if (fetch_fn is None):
+                print("AMP demo prefetch is not supported by the task, fetching demos synchronously.")
+            else:
+                self._amp_demo_producer = amp_demo_producer.AMPDemoProducer(fetch_fn, self._amp_batch_size,
+                                                                            self._amp_observation_space.shape, self.ppo_device,
+                                                                            prefetch_depth=amp_demo_prefetch)
+        return
 
+    def _close_amp_demo_producer(self):
+        if (getattr(self, '_amp_demo_producer', None) is not None):
+            self._amp_demo_producer.close()
+        self._amp_demo_producer = None
         return
     
     def _update_amp_demos(self):
+        if (self._amp_demo_producer is not None):
+            new_amp_obs_demo, slot_id = self._amp_demo_producer.get()
+            self._amp_obs_demo_buffer.store({'amp_obs': new_amp_obs_demo})
+            self._amp_demo_producer.release(slot_id)
+            return
+
         new_amp_obs_demo = self._fetch_amp_obs_demo(self._amp_batch_size)
         self._amp_obs_demo_buffer.store({'amp_obs': new_amp_obs_demo})
         return
@@ -516,8 +582,9 @@ class AMPAgent(common_agent.CommonAgent):
     def _store_replay_amp_obs(self, amp_obs):
         buf_size = self._amp_replay_buffer.get_buffer_size()
         buf_total_count = self._amp_replay_buffer.get_total_count()
-        if (buf_total_count > buf_size):
-            keep_probs = to_torch(np.array([self._amp_replay_keep_prob] * amp_obs.shape[0]), device=self.ppo_device)
+        # the reservoir keeps its own uniform sample over everything stored
+        if (not self._amp_replay_reservoir and not self._amp_replay_prioritized and buf_total_count > buf_size):
+            keep_probs = torch.full((amp_obs.shape[0],), self._amp_replay_keep_prob, device=self.ppo_device)
             keep_mask = torch.bernoulli(keep_probs) == 1.0
             amp_obs = amp_obs[keep_mask]
 
@@ -543,6 +610,10 @@ class AMPAgent(common_agent.CommonAgent):
         disc_reward_std, disc_reward_mean = torch.std_mean(train_info['disc_rewards'])
         self.writer.add_scalar('info/disc_reward_mean', disc_reward_mean.item(), frame)
         self.writer.add_scalar('info/disc_reward_std', disc_reward_std.item(), frame)
+
+        if (self._amp_demo_producer is not None):
+            self.writer.add_scalar('info/amp_demo_stalls', self._amp_demo_producer.num_stalls(), frame)
+            self.writer.add_scalar('info/amp_demo_stall_time', self._amp_demo_producer.stall_time(), frame)
         return
 
     def _amp_debug(self, info):
@@ -0,0 +1,152 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import queue
+import threading
+import time
+
+import torch
+
+
+class AMPDemoProducer():
+    """ Produces AMP demo batches on a background thread while the rollouts run.
+
+    fetch_fn(n) returns n demo AMP observations in a fresh tensor. It runs on the producer thread,
+    so it must not share buffers or random generators with the main thread. The thread writes them into one of
+    ``prefetch_depth`` preallocated slots (two give a double buffer), on its own CUDA stream on
+    a GPU. get() hands out the oldest ready slot and release() gives it back once the consumer
+    has enqueued its reads, the producer waits for those reads before overwriting the slot.
+
+    get() only blocks when no slot is ready, every such stall is counted together with the
+    time spent waiting.
+    """
+    def __init__(self, fetch_fn, batch_size, obs_shape, device, prefetch_depth=2):
+        assert(prefetch_depth >= 1), "AMP demo prefetch depth must be at least 1"
+        self._fetch_fn = fetch_fn
+        self._batch_size = batch_size
+        self._device = device
+
+        self._use_cuda = torch.device(device).type == "cuda"
+        self._stream = torch.cuda.Stream(device=device) if self._use_cuda else None
+
+        self._slots = [torch.zeros((batch_size,) + tuple(obs_shape), device=device, dtype=torch.float)
+                       for _ in range(prefetch_depth)]
+        self._ready_events = [None] * prefetch_depth
+        self._release_events = [None] * prefetch_depth
+
+        self._free_queue = queue.Queue()
+        self._ready_queue = queue.Queue()
+        for slot_id in range(prefetch_depth):
+            self._free_queue.put(slot_id)
+
+        self._num_batches = 0
+        self._num_stalls = 0
+        self._stall_time = 0.0
+        self._error = None
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._produce_loop, daemon=True)
+        self._thread.start()
+        return
+
+    def get(self):
+        try:
+            slot_id = self._ready_queue.get_nowait()
+        except queue.Empty:
+            start_time = time.time()
+            slot_id = self._wait_ready()
+            self._num_stalls += 1
+            self._stall_time += time.time() - start_time
+
+        if (self._use_cuda):
+            torch.cuda.current_stream(self._device).wait_event(self._ready_events[slot_id])
+
+        self._num_batches += 1
+        return self._slots[slot_id], slot_id
+
+    def release(self, slot_id):
+        if (self._use_cuda):
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(self._device))
+            self._release_events[slot_id] = event
+        self._free_queue.put(slot_id)
+        return
+
+    def num_batches(self):
+        return self._num_batches
+
+    def num_stalls(self):
+        return self._num_stalls
+
+    def stall_time(self):
+        return self._stall_time
+
+    def close(self):
+        self._stop_event.set()
+        self._thread.join()
+        return
+
+    def _wait_ready(self):
+        while (True):
+            try:
+                return self._ready_queue.get(timeout=0.1)
+            except queue.Empty:
+                if (self._error is not None):
+                    raise RuntimeError("AMP demo producer failed") from self._error
+        return
+
+    def _produce(self, slot_id):
+        slot = self._slots[slot_id]
+        if (not self._use_cuda):
+            slot[:] = self._fetch_fn(self._batch_size)
+            return
+
+        with torch.cuda.stream(self._stream):
+            if (self._release_events[slot_id] is not None):
+                self._stream.wait_event(self._release_events[slot_id])
+            slot[:] = self._fetch_fn(self._batch_size)
+            event = torch.cuda.Event()
+            event.record(self._stream)
+            self._ready_events[slot_id] = event
+        return
+
+    def _produce_loop(self):
+        while (not self._stop_event.is_set()):
+            try:
+                slot_id = self._free_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                self._produce(slot_id)
+            except Exception as e:
+                self._error = e
+                break
+            self._ready_queue.put(slot_id)
+
+        return
@@ -47,6 +47,8 @@ import torch
 from torch import optim
 
 import learning.amp_datasets as amp_datasets
+import learning.gae as gae
+import isaacgymenvs.utils.profiler as profiler
 
 from tensorboardX import SummaryWriter
 
@@ -61,6 +63,7 @@ class CommonAgent(a2c_continuous.A2CAgent):
         self._setup_action_space()
         self.bounds_loss_coef = config.get('bounds_loss_coef', None)
         self.clip_actions = config.get('clip_actions', True)
+        self._gae_scan = config.get('gae_scan', False)
 
         self.network_path = config.get('network_path', "./runs")
         self.network_path = os.path.join(self.network_path, self.config['name'])
@@ -99,6 +102,12 @@ class CommonAgent(a2c_continuous.A2CAgent):
 
         self.use_experimental_cv = self.config.get('use_experimental_cv', True)
         self.dataset = amp_datasets.AMPDataset(self.batch_size, self.minibatch_size, self.is_discrete, self.is_rnn, self.ppo_device, self.seq_len)
+
+        self.profiler = profiler.StepProfiler(self.ppo_device, enabled=config.get('profile_steps', False),
+                                     trace_file=config.get('profile_trace_file', None),
+                                     trace_epochs=config.get('profile_trace_epochs', 10))
+        self.vec_env.env.set_profiler(self.profiler)
+
         self.algo_observer.after_init(self)
         
         return
@@ -131,6 +140,7 @@ class CommonAgent(a2c_continuous.A2CAgent):
         while True:
             epoch_num = self.update_epoch()
             train_info = self.train_epoch()
+            profile = self.profiler.collect()
 
             sum_time = train_info['total_time']
             total_time += sum_time
@@ -152,6 +162,8 @@ class CommonAgent(a2c_continuous.A2CAgent):
                 self.writer.add_scalar('performance/step_fps', curr_frames / scaled_play_time, frame)
                 self.writer.add_scalar('info/epochs', epoch_num, frame)
                 self._log_train_info(train_info, frame)
+                if self.profiler.enabled:
+                    self.profiler.write_tensorboard(self.writer, frame, profile)
 
                 self.algo_observer.after_print_stats(frame, epoch_num, total_time)
                 
@@ -212,7 +224,8 @@ class CommonAgent(a2c_continuous.A2CAgent):
         for _ in range(0, self.mini_epochs_num):
             ep_kls = []
             for i in range(len(self.dataset)):
-                curr_train_info = self.train_actor_critic(self.dataset[i])
+                with self.profiler.scope("train_actor_critic"):
+                    curr_train_info = self.train_actor_critic(self.dataset[i])
                 
                 if self.schedule_type == 'legacy':  
                     if self.multi_gpu:
@@ -268,7 +281,8 @@ class CommonAgent(a2c_continuous.A2CAgent):
                 masks = self.vec_env.get_action_masks()
                 res_dict = self.get_masked_action_values(self.obs, masks)
             else:
-                res_dict = self.get_action_values(self.obs)
+                with self.profiler.scope("policy_inference"):
+                    res_dict = self.get_action_values(self.obs)
 
             for k in update_list:
                 self.experience_buffer.update_data(k, n, res_dict[k]) 
@@ -276,7 +290,8 @@ class CommonAgent(a2c_continuous.A2CAgent):
             if self.has_central_value:
                 self.experience_buffer.update_data('states', n, self.obs['states'])
 
-            self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
+            with self.profiler.scope("env_step"):
+                self.obs, rewards, self.dones, infos = self.env_step(res_dict['actions'])
             shaped_rewards = self.rewards_shaper(rewards)
             self.experience_buffer.update_data('rewards', n, shaped_rewards)
             self.experience_buffer.update_data('next_obses', n, self.obs['obs'])
@@ -284,7 +299,8 @@ class CommonAgent(a2c_continuous.A2CAgent):
 
             terminated = infos['terminate'].float()
             terminated = terminated.unsqueeze(-1)
-            next_vals = self._eval_critic(self.obs)
+            with self.profiler.scope("critic"):
+                next_vals = self._eval_critic(self.obs)
             next_vals *= (1.0 - terminated)
             self.experience_buffer.update_data('next_values', n, next_vals)
 
@@ -411,17 +427,12 @@ class CommonAgent(a2c_continuous.A2CAgent):
         return
 
     def discount_values(self, mb_fdones, mb_values, mb_rewards, mb_next_values):
-        lastgaelam = 0
-        mb_advs = torch.zeros_like(mb_rewards)
-
-        for t in reversed(range(self.horizon_length)):
-            not_done = 1.0 - mb_fdones[t]
-            not_done = not_done.unsqueeze(1)
-
-            delta = mb_rewards[t] + self.gamma * mb_next_values[t] - mb_values[t]
-            lastgaelam = delta + self.gamma * self.tau * not_done * lastgaelam
-            mb_advs[t] = lastgaelam
-
+        # mb_next_values are already masked by terminate in play_steps
+        if (self._gae_scan):
+            mb_advs = gae.compute_gae_scan(mb_fdones, mb_values, mb_rewards, mb_next_values,
+                                             float(self.gamma), float(self.tau))
+        else:
+            mb_advs = gae.compute_gae_loop(mb_fdones, mb_values, mb_rewards, mb_next_values, self.gamma, self.tau)
         return mb_advs
 
     def bound_loss(self, mu):
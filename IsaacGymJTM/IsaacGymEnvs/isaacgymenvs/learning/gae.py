@@ -0,0 +1,65 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+
+
+def compute_gae_loop(fdones, values, rewards, next_values, gamma, tau):
+    # reference implementation, one step of the recursion per iteration
+    horizon_length = rewards.shape[0]
+    lastgaelam = 0
+    advs = torch.zeros_like(rewards)
+
+    for t in reversed(range(horizon_length)):
+        not_done = 1.0 - fdones[t]
+        not_done = not_done.unsqueeze(1)
+
+        delta = rewards[t] + gamma * next_values[t] - values[t]
+        lastgaelam = delta + gamma * tau * not_done * lastgaelam
+        advs[t] = lastgaelam
+
+    return advs
+
+
+@torch.jit.script
+def compute_gae_scan(fdones, values, rewards, next_values, gamma, tau):
+    # type: (Tensor, Tensor, Tensor, Tensor, float, float) -> Tensor
+    # adv[t] = delta[t] + decay[t] * adv[t + 1] is a linear recurrence, each pair (decay, adv) is
+    # composed with the pair shift steps later, doubling shift until it covers the horizon
+    horizon_length = rewards.shape[0]
+    advs = rewards + gamma * next_values - values
+    decay = gamma * tau * (1.0 - fdones).unsqueeze(-1)
+
+    shift = 1
+    while shift < horizon_length:
+        n = horizon_length - shift
+        advs = torch.cat([torch.addcmul(advs[:n], decay[:n], advs[shift:]), advs[n:]], dim=0)
+        decay = torch.cat([decay[:n] * decay[shift:], decay[n:]], dim=0)
+        shift *= 2
+
+    return advs
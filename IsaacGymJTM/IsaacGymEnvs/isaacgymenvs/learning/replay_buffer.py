@@ -26,17 +26,47 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import math
+
 import torch
 
 
+STORAGE_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "uint8": torch.uint8
+}
+
+# headroom added to a feature's range whenever uint8 storage has to grow it, so requantizing stays rare
+QUANT_RANGE_MARGIN = 0.1
+
+# rows requantized at a time when a range grows, bounds the float temporaries
+QUANT_REQUANT_CHUNK = 65536
+
+
 class ReplayBuffer():
-    def __init__(self, buffer_size, device):
+    """ Ring buffer of transitions with sampling indices and permutations kept on the storage device.
+
+    storage_dtype selects how float entries are stored: "float32", "float16", "bfloat16" or "uint8".
+    uint8 stores 8 bit codes with a per-feature affine range that only grows, the stored codes of
+    grown features are requantized when a new batch falls outside of it. Samples are always returned
+    as float32.
+    """
+    def __init__(self, buffer_size, device, storage_dtype="float32"):
+        assert(storage_dtype in STORAGE_DTYPES), "unsupported replay storage dtype: {}".format(storage_dtype)
+
         self._head = 0
         self._total_count = 0
         self._buffer_size = buffer_size
         self._device = device
+        self._storage_dtype = storage_dtype
+        self._extra_rows = 0
         self._data_buf = None
-        self._sample_idx = torch.randperm(buffer_size)
+        self._quantized_keys = set()
+        self._quant_low = dict()
+        self._quant_scale = dict()
+        self._sample_idx = torch.randperm(buffer_size, device=self._device)
         self._sample_head = 0
 
         return
@@ -44,6 +74,8 @@ class ReplayBuffer():
     def reset(self):
         self._head = 0
         self._total_count = 0
+        self._quant_low = dict()
+        self._quant_scale = dict()
         self._reset_sample_idx()
         return
 
@@ -53,24 +85,31 @@ class ReplayBuffer():
     def get_total_count(self):
         return self._total_count
 
+    def get_storage_bytes(self):
+        if (self._data_buf is None):
+            return 0
+        return sum([v.element_size() * v.numel() for v in self._data_buf.values()])
+
     def store(self, data_dict):
         if (self._data_buf is None):
             self._init_data_buf(data_dict)
 
         n = next(iter(data_dict.values())).shape[0]
         buffer_size = self.get_buffer_size()
-        assert(n < buffer_size)
+        assert(n <= buffer_size)
 
         for key, curr_buf in self._data_buf.items():
             curr_n = data_dict[key].shape[0]
             assert(n == curr_n)
 
+            curr_data = self._encode(key, data_dict[key])
+
             store_n = min(curr_n, buffer_size - self._head)
-            curr_buf[self._head:(self._head + store_n)] = data_dict[key][:store_n]    
+            curr_buf[self._head:(self._head + store_n)] = curr_data[:store_n]
         
             remainder = n - store_n
             if (remainder > 0):
-                curr_buf[0:remainder] = data_dict[key][store_n:]  
+                curr_buf[0:remainder] = curr_data[store_n:]
 
         self._head = (self._head + n) % buffer_size
         self._total_count += n
@@ -81,7 +120,7 @@ class ReplayBuffer():
         total_count = self.get_total_count()
         buffer_size = self.get_buffer_size()
 
-        idx = torch.arange(self._sample_head, self._sample_head + n)
+        idx = torch.arange(self._sample_head, self._sample_head + n, device=self._device)
         idx = idx % buffer_size
         rand_idx = self._sample_idx[idx]
         if (total_count < buffer_size):
@@ -89,7 +128,7 @@ class ReplayBuffer():
 
         samples = dict()
         for k, v in self._data_buf.items():
-            samples[k] = v[rand_idx]
+            samples[k] = self._decode(k, v[rand_idx])
 
         self._sample_head += n
         if (self._sample_head >= buffer_size):
@@ -99,16 +138,234 @@ class ReplayBuffer():
 
     def _reset_sample_idx(self):
         buffer_size = self.get_buffer_size()
-        self._sample_idx[:] = torch.randperm(buffer_size)
+        torch.randperm(buffer_size, out=self._sample_idx)
         self._sample_head = 0
         return
 
     def _init_data_buf(self, data_dict):
-        buffer_size = self.get_buffer_size()
+        # subclasses can reserve rows past the end of the buffer through _extra_rows
+        num_rows = self.get_buffer_size() + self._extra_rows
         self._data_buf = dict()
 
         for k, v in data_dict.items():
             v_shape = v.shape[1:]
-            self._data_buf[k] = torch.zeros((buffer_size,) + v_shape, device=self._device)
+            dtype = STORAGE_DTYPES[self._storage_dtype] if v.is_floating_point() else v.dtype
+            if (v.is_floating_point() and self._storage_dtype == "uint8"):
+                self._quantized_keys.add(k)
+            self._data_buf[k] = torch.zeros((num_rows,) + v_shape, device=self._device, dtype=dtype)
+
+        return
+
+    def _encode(self, key, data):
+        if (key not in self._quantized_keys):
+            return data
+
+        self._update_quant_range(key, data)
+        codes = torch.round((data - self._quant_low[key]) / self._quant_scale[key])
+        return codes.clamp_(0, 255).to(torch.uint8)
+
+    def _decode(self, key, data):
+        if (key not in self._quantized_keys):
+            return data.float() if data.is_floating_point() else data
+        return data.float() * self._quant_scale[key] + self._quant_low[key]
+
+    def _update_quant_range(self, key, data):
+        flat_data = data.reshape(data.shape[0], -1)
+        low = torch.min(flat_data, dim=0)[0].reshape(data.shape[1:])
+        high = torch.max(flat_data, dim=0)[0].reshape(data.shape[1:])
+
+        if (key not in self._quant_low):
+            margin = QUANT_RANGE_MARGIN * (high - low)
+            self._quant_low[key] = low - margin
+            self._quant_scale[key] = torch.clamp((high + margin - self._quant_low[key]) / 255.0, min=1e-6)
+            return
+
+        # grown features get a new range with headroom
+        curr_low = self._quant_low[key]
+        curr_scale = self._quant_scale[key]
+        curr_high = curr_low + 255.0 * curr_scale
+        grow_low = low < curr_low
+        grow_high = high > curr_high
+        grown = torch.logical_or(grow_low, grow_high)
+
+        new_low = torch.minimum(low, curr_low)
+        new_high = torch.maximum(high, curr_high)
+        margin = QUANT_RANGE_MARGIN * (new_high - new_low)
+        new_low = torch.where(grow_low, new_low - margin, curr_low)
+        new_high = torch.where(grow_high, new_high + margin, curr_high)
+        new_scale = torch.where(grown, torch.clamp((new_high - new_low) / 255.0, min=1e-6), curr_scale)
+
+        # the margin keeps growth rare, so the common store pays one scalar sync and no requantization
+        num_stored = min(self._total_count, self.get_buffer_size())
+        if (num_stored > 0 and torch.any(grown)):
+            self._requantize(key, grown, curr_low, curr_scale, new_low, new_scale, num_stored)
+
+        self._quant_low[key] = new_low
+        self._quant_scale[key] = new_scale
+        return
+
+    def _requantize(self, key, grown, curr_low, curr_scale, new_low, new_scale, num_stored):
+        # only the grown feature columns move to the new range, in row chunks
+        grown_ids = torch.nonzero(grown.flatten()).squeeze(-1)
+        ratio = (curr_scale / new_scale).flatten()[grown_ids]
+        offset = ((curr_low - new_low) / new_scale).flatten()[grown_ids]
+
+        stored = self._data_buf[key].view(self._data_buf[key].shape[0], -1)
+        for start in range(0, num_stored, QUANT_REQUANT_CHUNK):
+            end = min(start + QUANT_REQUANT_CHUNK, num_stored)
+            codes = torch.round(stored[start:end, grown_ids].float() * ratio + offset)
+            stored[start:end, grown_ids] = codes.clamp_(0, 255).to(torch.uint8)
+
+        return
+
+
+class SumTree():
+    """ Binary sum-tree over per-slot priorities, stored as one flat tensor on the device.
+
+    Leaves live at [capacity, 2 * capacity). Updates and stratified sampling walk the tree one level
+    at a time for all indices together, so neither needs a host round trip.
+    """
+    def __init__(self, size, device):
+        self._depth = max(int(math.ceil(math.log2(max(size, 2)))), 1)
+        self._capacity = 2 ** self._depth
+        self._device = device
+        self._tree = torch.zeros(2 * self._capacity, device=self._device, dtype=torch.float)
+        return
+
+    def reset(self):
+        self._tree[:] = 0
+        return
+
+    def total(self):
+        return self._tree[1]
+
+    def get(self, idx):
+        return self._tree[idx + self._capacity]
+
+    def update(self, idx, priorities):
+        node_idx = idx + self._capacity
+        self._tree[node_idx] = priorities
+
+        # duplicate parents all write the same sum, so no deduplication is needed
+        for _ in range(self._depth):
+            node_idx = node_idx // 2
+            self._tree[node_idx] = self._tree[2 * node_idx] + self._tree[2 * node_idx + 1]
+
+        return
 
-        return
\ No newline at end of file
+    def sample(self, n):
+        segment = self.total() / n
+        targets = (torch.arange(n, device=self._device, dtype=torch.float)
+                   + torch.rand(n, device=self._device)) * segment
+
+        node_idx = torch.ones(n, device=self._device, dtype=torch.long)
+        for _ in range(self._depth):
+            left_idx = 2 * node_idx
+            left_sum = self._tree[left_idx]
+            go_right = targets > left_sum
+            targets = torch.where(go_right, targets - left_sum, targets)
+            node_idx = left_idx + go_right.long()
+
+        return node_idx - self._capacity
+
+
+class ReservoirReplayBuffer(ReplayBuffer):
+    """ Replay buffer that keeps a uniform sample of everything ever stored (reservoir sampling).
+
+    Once full, the t-th incoming entry replaces a random slot with probability buffer_size / (t + 1).
+    Rejected entries are written to a scratch row past the end of the buffer, which keeps the store
+    free of host syncs. Entries of the same batch that draw the same slot resolve in arbitrary order.
+
+    With prioritized set, samples are drawn from a sum-tree in proportion to their priority instead
+    of from a permutation. New entries get the largest priority seen so far, update_priorities sets
+    them from the discriminator logits of sampled entries. Samples carry their slots under "idx".
+    """
+    def __init__(self, buffer_size, device, storage_dtype="float32", prioritized=False,
+                 priority_alpha=0.6, priority_eps=1e-3):
+        super().__init__(buffer_size, device, storage_dtype=storage_dtype)
+
+        # one extra scratch row receives the entries rejected by the reservoir
+        self._extra_rows = 1
+        self._prioritized = prioritized
+        self._priority_alpha = priority_alpha
+        self._priority_eps = priority_eps
+        self._sum_tree = None
+        if (self._prioritized):
+            self._sum_tree = SumTree(buffer_size + 1, self._device)
+            self._max_priority = torch.ones(1, device=self._device, dtype=torch.float)
+
+        return
+
+    def reset(self):
+        super().reset()
+        if (self._prioritized):
+            self._sum_tree.reset()
+            self._max_priority[:] = 1.0
+        return
+
+    def is_prioritized(self):
+        return self._prioritized
+
+    def store(self, data_dict):
+        if (self._data_buf is None):
+            self._init_data_buf(data_dict)
+
+        n = next(iter(data_dict.values())).shape[0]
+        buffer_size = self.get_buffer_size()
+        assert(n <= buffer_size)
+
+        num_stored = min(self._total_count, buffer_size)
+        num_fill = min(n, buffer_size - num_stored)
+        fill_slots = torch.arange(num_stored, num_stored + num_fill, device=self._device)
+
+        # reservoir draws for the entries that arrive after the buffer is full
+        num_draw = n - num_fill
+        t = torch.arange(self._total_count + num_fill, self._total_count + n, device=self._device)
+        draw_slots = torch.floor(torch.rand(num_draw, device=self._device) * (t + 1)).long()
+        draw_slots = torch.where(draw_slots < buffer_size, draw_slots, torch.full_like(draw_slots, buffer_size))
+        slots = torch.cat([fill_slots, draw_slots])
+
+        for key, curr_buf in self._data_buf.items():
+            assert(n == data_dict[key].shape[0])
+            curr_buf[slots] = self._encode(key, data_dict[key])
+
+        if (self._prioritized):
+            priorities = torch.where(slots < buffer_size, self._max_priority.expand(n), torch.zeros_like(self._max_priority).expand(n))
+            self._sum_tree.update(slots, priorities)
+
+        self._total_count += n
+        self._head = min(self._total_count, buffer_size) % buffer_size
+
+        return
+
+    def sample(self, n):
+        if (not self._prioritized):
+            total_count = self.get_total_count()
+            buffer_size = self.get_buffer_size()
+
+            idx = torch.arange(self._sample_head, self._sample_head + n, device=self._device)
+            rand_idx = self._sample_idx[idx % buffer_size]
+            if (total_count < buffer_size):
+                rand_idx = rand_idx % self._head
+
+            self._sample_head += n
+            if (self._sample_head >= buffer_size):
+                self._reset_sample_idx()
+        else:
+            num_stored = min(self._total_count, self.get_buffer_size())
+            rand_idx = torch.clamp(self._sum_tree.sample(n), max=num_stored - 1)
+
+        samples = dict()
+        for k, v in self._data_buf.items():
+            samples[k] = self._decode(k, v[rand_idx])
+        samples["idx"] = rand_idx
+
+        return samples
+
+    def update_priorities(self, idx, disc_logits):
+        # confidence of the discriminator that the entries come from the agent
+        agent_prob = torch.sigmoid(-disc_logits.detach().float().flatten())
+        priorities = torch.pow(agent_prob + self._priority_eps, self._priority_alpha)
+        self._sum_tree.update(idx, priorities)
+        torch.maximum(self._max_priority, torch.max(priorities).unsqueeze(0), out=self._max_priority)
+        return
@@ -1,3 +1,4 @@
+import functools
 import os
 import torch
 
@@ -7,6 +8,10 @@ from isaacgym.torch_utils import *
 
 from isaacgymenvs.utils.torch_jit_utils import *
 from ..base.vec_task import VecTask
+from ..base.sim_tensors import SimTensorRefresher
+from ..base.step_graph import StepGraph
+from isaacgymenvs.utils.profiler import NULL_PROFILER
+from ..base.actor_layout import ActorLayout
 
 DOF_BODY_IDS    = [1, 2, 3,
                     4, 5, 6, 7, 8, 9,
@@ -46,6 +51,7 @@ class AtlasObjAMPBase(VecTask):
         self._contact_bodies = self.cfg["env"]["contactBodies"]
         self._termination_height = self.cfg["env"]["terminationHeight"]
         self._enable_early_termination = self.cfg["env"]["enableEarlyTermination"]
+        self._enable_force_sensors = self.cfg["env"].get("enableForceSensors", False)
 
         self.cfg["env"]["numObservations"] = self.get_obs_size()
         self.cfg["env"]["numActions"] = self.get_action_size()
@@ -58,15 +64,19 @@ class AtlasObjAMPBase(VecTask):
         # get gym GPU state tensors
         actor_root_state = self.gym.acquire_actor_root_state_tensor(self.sim)
         dof_state_tensor = self.gym.acquire_dof_state_tensor(self.sim)
-        sensor_tensor = self.gym.acquire_force_sensor_tensor(self.sim)
         rigid_body_state = self.gym.acquire_rigid_body_state_tensor(self.sim) # 공과 겹침
         contact_force_tensor = self.gym.acquire_net_contact_force_tensor(self.sim)
 
-        sensors_per_env = 2
-        self.vec_sensor_tensor = gymtorch.wrap_tensor(sensor_tensor).view(self.num_envs, sensors_per_env * 6)
+        # foot force sensors and dof forces are only created on request, no term reads them
+        self.vec_sensor_tensor = None
+        self.dof_force_tensor = None
+        if (self._enable_force_sensors):
+            sensors_per_env = 2
+            sensor_tensor = self.gym.acquire_force_sensor_tensor(self.sim)
+            self.vec_sensor_tensor = gymtorch.wrap_tensor(sensor_tensor).view(self.num_envs, sensors_per_env * 6)
 
-        dof_force_tensor = self.gym.acquire_dof_force_tensor(self.sim)
-        self.dof_force_tensor = gymtorch.wrap_tensor(dof_force_tensor).view(self.num_envs, self.num_dof)
+            dof_force_tensor = self.gym.acquire_dof_force_tensor(self.sim)
+            self.dof_force_tensor = gymtorch.wrap_tensor(dof_force_tensor).view(self.num_envs, self.num_dof)
 
         self.gym.refresh_dof_state_tensor(self.sim)
         self.gym.refresh_actor_root_state_tensor(self.sim)
@@ -79,16 +89,18 @@ class AtlasObjAMPBase(VecTask):
 
         # Added from JTM, Set actor indices
         self.actor_indices = torch.arange(NUM_ACTORS_PER_ENVS * self.num_envs, dtype=torch.long, device=self.device).view(self.num_envs, NUM_ACTORS_PER_ENVS)
-        self.humanoid_ids = self.actor_indices[:,0]
-        self.ball_ids = self.actor_indices[:,1]
+        self.humanoid_ids = self.actor_layout.actor_ids("humanoid", self.num_envs, self.device)[:, 0]
+        self.ball_ids = self.actor_layout.actor_ids("ball", self.num_envs, self.device)[:, 0]
 
         # Added from JTM, Set actor states
-        self.humanoid_states = self._root_states[self.humanoid_ids]
-        self.ball_states = self._root_states[self.ball_ids]
+        # views into the root state tensor, they follow every refresh without a gather
+        self.humanoid_states = self.actor_layout.root_states(self._root_states, "humanoid")[:, 0]
+        self.ball_states = self.actor_layout.root_states(self._root_states, "ball")[:, 0]
 
         # Added from JTM, Initial root state
         self._initial_root_states = self._root_states.clone()
         self._initial_root_states[:, 7:13] = 0
+        self._initial_ball_states = self.actor_layout.root_states(self._initial_root_states, "ball")[:, 0]
 
         # create some wrapper tensors for different slices
         self._dof_state = gymtorch.wrap_tensor(dof_state_tensor)
@@ -106,16 +118,52 @@ class AtlasObjAMPBase(VecTask):
         self._rigid_body_state = gymtorch.wrap_tensor(rigid_body_state)
 
         # l5vd5 collision
-        num_balls=0
         # only a humanoid (exclude balls)
-        self._rigid_body_state = self._rigid_body_state.view(self.num_envs, self.num_bodies+num_balls, 13)#[:, :self.num_bodies, 0:3]
-        self._rigid_body_pos = self._rigid_body_state[:, :, 0:3]#[:, :self.num_bodies, 0:3]
-        self._rigid_body_rot = self._rigid_body_state[:, :, 3:7]#[:, :self.num_bodies, 3:7]
-        self._rigid_body_vel = self._rigid_body_state[:, :, 7:10]#[:, :self.num_bodies, 7:10]
-        self._rigid_body_ang_vel = self._rigid_body_state[:, :, 10:13]#[:, :self.num_bodies, 10:13]
-        self._contact_forces = gymtorch.wrap_tensor(contact_force_tensor).view(self.num_envs, self.num_bodies+num_balls, 3)#[:, :self.num_bodies, :]
+        humanoid_body_state = self.actor_layout.body_states(self._rigid_body_state, "humanoid")
+        self._rigid_body_pos = humanoid_body_state[..., 0:3]
+        self._rigid_body_rot = humanoid_body_state[..., 3:7]
+        self._rigid_body_vel = humanoid_body_state[..., 7:10]
+        self._rigid_body_ang_vel = humanoid_body_state[..., 10:13]
+        self._contact_forces = self.actor_layout.body_states(gymtorch.wrap_tensor(contact_force_tensor), "humanoid")
         
         self._terminate_buf = torch.ones(self.num_envs, device=self.device, dtype=torch.long)
+
+        # per env termination flags (fall contact, fall height, terminated, timeout) and the number of
+        # resets each flag contributed to since the last log, kept on the device and logged from extras
+        self._termination_reasons = torch.zeros((4, self.num_envs), device=self.device, dtype=torch.bool)
+        self._termination_counts = torch.zeros(4, device=self.device, dtype=torch.long)
+        self._termination_metrics = {
+            "termination/fall_contact": self._termination_counts[0],
+            "termination/fall_height": self._termination_counts[1],
+            "termination/terminated": self._termination_counts[2],
+            "termination/timeout": self._termination_counts[3]
+        }
+
+        # bodies that are not allowed to touch the ground
+        self._non_contact_body_mask = torch.ones(self._rigid_body_pos.shape[1], device=self.device, dtype=torch.bool)
+        self._non_contact_body_mask[self._contact_body_ids] = False
+
+        self._sim_tensor_refresher = SimTensorRefresher(self.gym, self.sim, self._get_sim_tensor_consumers(),
+                                                        debug=self.cfg["env"].get("debugStaleSimTensors", False))
+        self._sim_tensor_refresher.guard(self, {
+            "rigid_body_state": ["_rigid_body_state", "_rigid_body_pos", "_rigid_body_rot",
+                                 "_rigid_body_vel", "_rigid_body_ang_vel"],
+            "net_contact_force": ["_contact_forces"],
+            "force_sensor": ["vec_sensor_tensor"],
+            "dof_force": ["dof_force_tensor"]
+        })
+
+        # contacts are only read with early termination, without it they are not refreshed (a StaleSimTensor
+        # in debug mode) and the scripted reset kernel gets an empty placeholder instead
+        self._reset_contact_forces = self._contact_forces
+        if (not self._enable_early_termination):
+            self._reset_contact_forces = torch.zeros((self.num_envs, 0, 3), device=self.device, dtype=torch.float)
+
+        # with static step buffers the fixed-shape step terms are replayed from a CUDA graph, so the
+        # steady-state step requests no memory at all, randomization reassigns buffers and opts out
+        self._step_terms_graph = None
+        if (self.static_step_buffers and torch.device(self.device).type == "cuda" and not self.randomize):
+            self._step_terms_graph = StepGraph(functools.partial(self._compute_step_terms, NULL_PROFILER))
         
         if self.viewer != None:
             self._init_camera()   
@@ -142,6 +190,7 @@ class AtlasObjAMPBase(VecTask):
 
     def reset_idx(self, env_ids):
         self._reset_actors(env_ids)
+        self.reset_transaction.commit(self._root_states, self._dof_state)
         self._refresh_sim_tensors()
         self._compute_observations(env_ids)
         return
@@ -190,6 +239,10 @@ class AtlasObjAMPBase(VecTask):
         ball_options.density = 100.27 # Soccer ball has 410~450g weight.
         ball_asset = self.gym.create_sphere(self.sim, ball_radius, ball_options)
 
+        # every env creates its actors in this order
+        self.actor_layout = ActorLayout()
+        self.actor_layout.add_actor("humanoid", self.gym.get_asset_rigid_body_count(humanoid_asset))
+        self.actor_layout.add_actor("ball", self.gym.get_asset_rigid_body_count(ball_asset))
 
         actuator_props = self.gym.get_asset_actuator_properties(humanoid_asset)
         motor_efforts = [prop.motor_effort for prop in actuator_props]
@@ -206,8 +259,9 @@ class AtlasObjAMPBase(VecTask):
         left_foot_idx = self.gym.find_asset_rigid_body_index(humanoid_asset, "l_foot")   # modified for Atlas
         sensor_pose = gymapi.Transform()
 
-        self.gym.create_asset_force_sensor(humanoid_asset, right_foot_idx, sensor_pose)
-        self.gym.create_asset_force_sensor(humanoid_asset, left_foot_idx, sensor_pose)
+        if (self._enable_force_sensors):
+            self.gym.create_asset_force_sensor(humanoid_asset, right_foot_idx, sensor_pose)
+            self.gym.create_asset_force_sensor(humanoid_asset, left_foot_idx, sensor_pose)
 
         self.max_motor_effort = max(motor_efforts)
         self.motor_efforts = to_torch(motor_efforts, device=self.device)
@@ -248,7 +302,8 @@ class AtlasObjAMPBase(VecTask):
             # ball_handle = self.gym.create_actor(env_ptr, ball_asset, pose, None)
             # box_handle = self.gym.create_actor(env_ptr, asset_box, pose, None)
 
-            self.gym.enable_actor_dof_force_sensors(env_ptr, handle)
+            if (self._enable_force_sensors):
+                self.gym.enable_actor_dof_force_sensors(env_ptr, handle)
 
             for j in range(self.num_bodies):
                 self.gym.set_rigid_body_color(
@@ -274,6 +329,8 @@ class AtlasObjAMPBase(VecTask):
                 dof_prop["driveMode"] = gymapi.DOF_MODE_POS
                 self.gym.set_actor_dof_properties(env_ptr, handle, dof_prop)
 
+        assert(self.gym.get_actor_count(env_ptr) == self.actor_layout.num_actors), "Env actors do not match the actor layout"
+
         dof_prop = self.gym.get_actor_dof_properties(env_ptr, handle)
         for j in range(self.num_dof):
             if dof_prop['lower'][j] > dof_prop['upper'][j]:
@@ -338,24 +395,37 @@ class AtlasObjAMPBase(VecTask):
         return
 
     def _compute_reset(self):
-        self.reset_buf[:], self._terminate_buf[:] = compute_humanoid_reset(self.reset_buf, self.progress_buf,
-                                                   self._contact_forces, self._contact_body_ids,
-                                                   self._rigid_body_pos, self.max_episode_length,
-                                                   self._enable_early_termination, self._termination_height)
+        compute_humanoid_reset(self.reset_buf, self._terminate_buf, self._termination_reasons, self.progress_buf,
+                               self._reset_contact_forces, self._non_contact_body_mask, self._rigid_body_pos,
+                               self.max_episode_length, self._enable_early_termination, self._termination_height)
+        # only count the flags of envs that actually reset this step
+        torch.logical_and(self._termination_reasons, self.reset_buf.unsqueeze(0), out=self._termination_reasons)
+        self._termination_counts += torch.sum(self._termination_reasons, dim=-1)
+        return
+
+    def reset_termination_counts(self):
+        # called once the counts were logged, so each log covers one epoch
+        self._termination_counts.zero_()
         return
 
     def _refresh_sim_tensors(self):
         # TODO: cuda error
         # an illegal memory access was encountered
-        self.gym.refresh_dof_state_tensor(self.sim)
-        self.gym.refresh_actor_root_state_tensor(self.sim)
-        self.gym.refresh_rigid_body_state_tensor(self.sim)
-
-        self.gym.refresh_force_sensor_tensor(self.sim)
-        self.gym.refresh_dof_force_tensor(self.sim)
-        self.gym.refresh_net_contact_force_tensor(self.sim)
+        self._sim_tensor_refresher.refresh()
         return
 
+    def _get_sim_tensor_consumers(self):
+        # sim tensors read by the observation, reward and termination terms, only these are
+        # refreshed every step (the root and dof states always are)
+        consumers = {
+            "observations": ["rigid_body_state"],
+            "reward": [],
+            "reset": ["rigid_body_state", "net_contact_force"] if (self._enable_early_termination) else []
+        }
+        if (self._enable_force_sensors):
+            consumers["force_sensors"] = ["force_sensor", "dof_force"]
+        return consumers
+
     def _compute_observations(self, env_ids=None):
         obs = self._compute_humanoid_obs(env_ids)
 
@@ -368,12 +438,12 @@ class AtlasObjAMPBase(VecTask):
 
     def _compute_humanoid_obs(self, env_ids=None):
         if (env_ids is None):
-            root_states = self._root_states
+            root_states = self.humanoid_states
             dof_pos = self._dof_pos
             dof_vel = self._dof_vel
             key_body_pos = self._rigid_body_pos[:, self._key_body_ids, :]
         else:
-            root_states = self._root_states[env_ids]
+            root_states = self.humanoid_states[env_ids]
             dof_pos = self._dof_pos[env_ids]
             dof_vel = self._dof_vel[env_ids]
             key_body_pos = self._rigid_body_pos[env_ids][:, self._key_body_ids, :]
@@ -383,17 +453,13 @@ class AtlasObjAMPBase(VecTask):
         return obs
 
     def _reset_actors(self, env_ids):
+        actor_ids = self.humanoid_ids[env_ids]
+        self._root_states[actor_ids] = self._initial_root_states[actor_ids]
         self._dof_pos[env_ids] = self._initial_dof_pos[env_ids]
         self._dof_vel[env_ids] = self._initial_dof_vel[env_ids]
 
-        env_ids_int32 = env_ids.to(dtype=torch.int32)
-        self.gym.set_actor_root_state_tensor_indexed(self.sim,
-                                                     gymtorch.unwrap_tensor(self._initial_root_states),
-                                                     gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
-
-        self.gym.set_dof_state_tensor_indexed(self.sim,
-                                              gymtorch.unwrap_tensor(self._dof_state),
-                                              gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
+        self.reset_transaction.stage_root_states(actor_ids)
+        self.reset_transaction.stage_dof_states(actor_ids)
 
         self.progress_buf[env_ids] = 0
         self.reset_buf[env_ids] = 0
@@ -420,12 +486,16 @@ class AtlasObjAMPBase(VecTask):
     def post_physics_step(self):
         self.progress_buf += 1
 
-        self._refresh_sim_tensors()
-        self._compute_observations()
-        self._compute_reward(self.actions)
-        self._compute_reset()
+        with self.profiler.scope("refresh_sim_tensors"):
+            self._refresh_sim_tensors()
+        if (self._step_terms_graph is not None):
+            with self.profiler.scope("step_terms"):
+                self._step_terms_graph()
+        else:
+            self._compute_step_terms(self.profiler)
         
         self.extras["terminate"] = self._terminate_buf
+        self.extras.update(self._termination_metrics)
 
         # debug viz
         if self.viewer and self.debug_viz:
@@ -433,6 +503,16 @@ class AtlasObjAMPBase(VecTask):
 
         return
 
+    def _compute_step_terms(self, profiler):
+        # observations, reward and termination of the whole batch, fixed-shape and free of host syncs
+        with profiler.scope("compute_observations"):
+            self._compute_observations()
+        with profiler.scope("compute_reward"):
+            self._compute_reward(self.actions)
+        with profiler.scope("compute_reset"):
+            self._compute_reset()
+        return
+
     def render(self):
         if self.viewer and self.camera_follow:
             self._update_camera()
@@ -581,30 +661,35 @@ def compute_humanoid_reward(obs_buf):
     return reward
 
 @torch.jit.script
-def compute_humanoid_reset(reset_buf, progress_buf, contact_buf, contact_body_ids, rigid_body_pos,
-                           max_episode_length, enable_early_termination, termination_height):
-    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, float, bool, float) -> Tuple[Tensor, Tensor]
-    terminated = torch.zeros_like(reset_buf)
+def compute_humanoid_reset(reset_buf, terminate_buf, termination_reasons, progress_buf, contact_buf,
+                           non_contact_body_mask, rigid_body_pos, max_episode_length,
+                           enable_early_termination, termination_height):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, float, bool, float) -> None
+    # every flag is written into the preallocated termination_reasons rows,
+    # (fall contact, fall height, terminated, timeout) x num_envs
+    fall_contact = termination_reasons[0]
+    fall_height = termination_reasons[1]
+    terminated = termination_reasons[2]
+    timeout = termination_reasons[3]
 
     if (enable_early_termination):
-        masked_contact_buf = contact_buf.clone() # (4096, 31, 3)
-        masked_contact_buf[:, contact_body_ids, :] = 0 # masking contact body ids (foot, ...)
-        fall_contact = torch.any(masked_contact_buf > 0.1, dim=-1) # check body has fallen
-        fall_contact = torch.any(fall_contact, dim=-1) # get fall env
+        # a body is in contact if any force component exceeds the threshold,
+        # bodies that are allowed to touch the ground (foot, ...) are masked out
+        body_contact = torch.logical_and(torch.amax(contact_buf, dim=-1) > 0.1, non_contact_body_mask)
+        torch.any(body_contact, dim=-1, out=fall_contact)
 
-        body_height = rigid_body_pos[..., 2]
-        
-        fall_height = body_height < termination_height
-        fall_height[:, contact_body_ids] = False
-        fall_height = torch.any(fall_height, dim=-1)
-
-        has_fallen = torch.logical_and(fall_contact, fall_height)
+        body_low = torch.logical_and(rigid_body_pos[..., 2] < termination_height, non_contact_body_mask)
+        torch.any(body_low, dim=-1, out=fall_height)
 
         # first timestep can sometimes still have nonzero contact forces
         # so only check after first couple of steps
-        has_fallen *= (progress_buf > 1)
-        terminated = torch.where(has_fallen, torch.ones_like(reset_buf), terminated)
-    
-    reset = torch.where(progress_buf >= max_episode_length - 1, torch.ones_like(reset_buf), terminated)
+        torch.logical_and(fall_contact, fall_height, out=terminated)
+        terminated.logical_and_(progress_buf > 1)
+    else:
+        termination_reasons[0:3].fill_(False)
+
+    torch.ge(progress_buf, max_episode_length - 1, out=timeout)
 
-    return reset, terminated
\ No newline at end of file
+    terminate_buf.copy_(terminated)
+    torch.logical_or(terminated, timeout, out=reset_buf)
+    return
@@ -0,0 +1,128 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import os
+import tempfile
+
+import torch
+
+# bump whenever the demo AMP observations change layout, old snapshots are then ignored
+AMP_DEMO_SNAPSHOT_VERSION = 1
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def build_demo_snapshot_key(files, config):
+    # the snapshot is valid as long as every file it was sampled from and every setting that
+    # shapes the observations are unchanged
+    h = hashlib.sha1()
+    h.update("v{:d}|{:s}|".format(AMP_DEMO_SNAPSHOT_VERSION, json.dumps(config, sort_keys=True)).encode())
+    for file in files:
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def load_demo_snapshot(snapshot_file, num_samples, device):
+    if (not os.path.exists(snapshot_file)):
+        return None
+
+    snapshot = torch.load(snapshot_file, map_location="cpu")
+    if (snapshot.get("version") != AMP_DEMO_SNAPSHOT_VERSION):
+        return None
+
+    amp_obs_demo = snapshot["amp_obs_demo"]
+    if (amp_obs_demo.shape[0] < num_samples):
+        return None
+
+    print("Loaded {:d} AMP demo observations from {:s}".format(num_samples, snapshot_file))
+    return amp_obs_demo[:num_samples].to(device)
+
+
+def save_demo_snapshot(snapshot_file, amp_obs_demo):
+    snapshot_dir = os.path.dirname(snapshot_file)
+
+    # write next to the target first so concurrent runs never read a partial snapshot
+    tmp_file = None
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=snapshot_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            torch.save({"version": AMP_DEMO_SNAPSHOT_VERSION,
+                        "amp_obs_demo": amp_obs_demo.cpu()}, f)
+        os.replace(tmp_file, snapshot_file)
+    except OSError:
+        # the dir is not writable, the demo buffer is still filled
+        if (tmp_file is not None and os.path.exists(tmp_file)):
+            os.remove(tmp_file)
+
+    return
+
+
+def build_task_snapshot_file(env_cfg, motion_file, motion_lib, config):
+    # None when snapshots are disabled, relative snapshot dirs are resolved next to the motion file
+    snapshot_dir = env_cfg.get("ampDemoSnapshotDir", None)
+    if (snapshot_dir is None):
+        return None
+
+    config = dict(config)
+    config.update({
+        "window_order": env_cfg.get("ampObsWindowOrder", "newest_first"),
+        "amp_obs_table": motion_lib.has_amp_obs_table(),
+        "streaming": env_cfg.get("streamingMotionLib", False),
+        "vel_scheme": env_cfg.get("motionVelScheme", "forward"),
+        "vel_smoothing": env_cfg.get("motionVelSmoothing", 0.0)
+    })
+
+    files = [motion_file] + motion_lib.get_motion_files()
+    motion_bank_file = env_cfg.get("motionBankFile", None)
+    if (motion_bank_file is not None):
+        files.append(os.path.join(os.path.dirname(motion_file), motion_bank_file))
+    # every bank trajectory reports the base file, hash each file only once
+    files = list(dict.fromkeys(files))
+
+    snapshot_dir = os.path.join(os.path.dirname(motion_file), snapshot_dir)
+    return os.path.join(snapshot_dir, build_demo_snapshot_key(files, config) + ".pt")
+
+
+def fetch_demo_bulk(sample_fn, num_samples, num_amp_obs, batch_size, device, snapshot_file=None):
+    # the whole demo buffer in a few large queries, or straight from the snapshot of an earlier run
+    if (snapshot_file is not None):
+        amp_obs_demo = load_demo_snapshot(snapshot_file, num_samples, device)
+        if (amp_obs_demo is not None):
+            return amp_obs_demo
+
+    amp_obs_demo = [sample_fn(min(batch_size, num_samples - i)) for i in range(0, num_samples, batch_size)]
+    amp_obs_demo = torch.cat(amp_obs_demo, dim=0).view(num_samples, num_amp_obs)
+
+    if (snapshot_file is not None):
+        save_demo_snapshot(snapshot_file, amp_obs_demo)
+    return amp_obs_demo
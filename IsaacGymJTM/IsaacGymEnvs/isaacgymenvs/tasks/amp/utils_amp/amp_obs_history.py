@@ -0,0 +1,141 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+
+WINDOW_ORDERS = ["newest_first", "oldest_first"]
+
+
+class AMPObsHistory():
+    """ Circular buffer holding the last num_steps AMP frames of every env.
+
+    head[i] is the slot of the newest frame of env i and the frame k steps older lives in
+    slot (head[i] + k) % num_steps, so moving the history forward only moves the heads.
+    Windows are read out newest_first (the layout of the old shifted buffer) or oldest_first.
+    """
+    def __init__(self, num_envs, num_steps, obs_size, device, window_order="newest_first"):
+        assert(window_order in WINDOW_ORDERS), "Unsupported AMP window order: {:s}".format(window_order)
+        self.num_steps = num_steps
+        self.obs_size = obs_size
+        self._device = device
+
+        self._buf = torch.zeros((num_envs, num_steps, obs_size), device=device, dtype=torch.float)
+        self._head = torch.zeros(num_envs, device=device, dtype=torch.long)
+        self._env_ids = torch.arange(num_envs, device=device, dtype=torch.long)
+
+        # age of the frame at every position of a window
+        self._window_ages = torch.arange(num_steps, device=device, dtype=torch.long)
+        if (window_order == "oldest_first"):
+            self._window_ages = self._window_ages.flip(0)
+        self._hist_ages = torch.arange(1, num_steps, device=device, dtype=torch.long)
+
+        self._flat_buf = torch.zeros((num_envs, num_steps * obs_size), device=device, dtype=torch.float)
+        self._flat_valid = False
+        return
+
+    def advance(self, env_ids=None):
+        # the slot of the oldest frame becomes the head and is overwritten by the next frame
+        if (env_ids is None):
+            self._head.sub_(1).remainder_(self.num_steps)
+        else:
+            self._head[env_ids] = (self._head[env_ids] - 1) % self.num_steps
+        self._flat_valid = False
+        return
+
+    def get_current(self, env_ids=None):
+        if (env_ids is None):
+            return self._buf[self._env_ids, self._head]
+        return self._buf[env_ids, self._head[env_ids]]
+
+    def set_current(self, obs, env_ids=None):
+        if (env_ids is None):
+            self._buf[self._env_ids, self._head] = obs
+        else:
+            self._buf[env_ids, self._head[env_ids]] = obs
+        self._flat_valid = False
+        return
+
+    def set_history(self, obs, env_ids):
+        # obs is (len(env_ids), num_steps - 1, obs_size), the previous frame first
+        slots = (self._head[env_ids].unsqueeze(-1) + self._hist_ages) % self.num_steps
+        self._buf[env_ids.unsqueeze(-1), slots] = obs
+        self._flat_valid = False
+        return
+
+    def fill_history(self, env_ids):
+        curr_obs = self.get_current(env_ids).unsqueeze(-2)
+        self.set_history(curr_obs.expand(-1, self.num_steps - 1, -1), env_ids)
+        return
+
+    def window(self, env_ids=None):
+        if (env_ids is None):
+            env_ids = self._env_ids
+        slots = (self._head[env_ids].unsqueeze(-1) + self._window_ages) % self.num_steps
+        return self._buf[env_ids.unsqueeze(-1), slots]
+
+    def flat(self):
+        # (num_envs, num_steps * obs_size), gathered at most once per step
+        if (not self._flat_valid):
+            slots = (self._head.unsqueeze(-1) + self._window_ages) % self.num_steps
+            index = slots.unsqueeze(-1).expand(-1, -1, self.obs_size)
+            torch.gather(self._buf, 1, index, out=self._flat_buf.view(self._buf.shape))
+            self._flat_valid = True
+        return self._flat_buf
+
+    def invalidate(self):
+        # the buffer was written without going through the methods above
+        self._flat_valid = False
+        return
+
+    def window_time_offsets(self, dt):
+        # time of every window position relative to the newest frame
+        return -dt * self._window_ages.float()
+
+
+class LazyValue():
+    def __init__(self, fn):
+        self._fn = fn
+        return
+
+    def __call__(self):
+        return self._fn()
+
+
+class LazyExtras(dict):
+    """ extras dict that evaluates LazyValue entries the first time they are looked up. """
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if (isinstance(value, LazyValue)):
+            value = value()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if (key in self):
+            return self[key]
+        return default
@@ -0,0 +1,181 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+
+# bump whenever the layout or the way the derived arrays are computed changes,
+# old entries are then ignored and rebuilt
+MOTION_CACHE_VERSION = 1
+
+MOTION_CACHE_ARRAYS = ["global_translation",
+                       "global_rotation",
+                       "local_rotation",
+                       "q_pos",
+                       "dof_vels",
+                       "global_root_velocity",
+                       "global_root_angular_velocity"]
+
+_META_FILE = "meta.json"
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+class CachedMotion():
+    """ Read-only stand-in for SkeletonMotion backed by precomputed arrays.
+
+    Exposes the attributes MotionLib reads from a clip. When the arrays are memory-mapped
+    from the cache the torch tensors share memory with the files, so nothing is copied
+    until the data is actually touched.
+    """
+    def __init__(self, arrays, fps):
+        self.global_translation = torch.from_numpy(arrays["global_translation"])
+        self.global_rotation = torch.from_numpy(arrays["global_rotation"])
+        self.local_rotation = torch.from_numpy(arrays["local_rotation"])
+        self.global_root_velocity = torch.from_numpy(arrays["global_root_velocity"])
+        self.global_root_angular_velocity = torch.from_numpy(arrays["global_root_angular_velocity"])
+        self.q_pos = arrays["q_pos"]
+        self.dof_vels = arrays["dof_vels"]
+        self._fps = fps
+        return
+
+    def __len__(self):
+        return self.global_translation.shape[0]
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def num_joints(self):
+        return self.global_translation.shape[1]
+
+
+class MotionCache():
+    def __init__(self, cache_dir, skeleton_key):
+        self._cache_dir = cache_dir
+        self._skeleton_key = skeleton_key
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+        except OSError:
+            # an unwritable cache dir only disables storing, existing entries are still read
+            pass
+        return
+
+    def get_key(self, motion_file):
+        h = hashlib.sha1()
+        h.update("v{:d}|{:s}|".format(MOTION_CACHE_VERSION, self._skeleton_key).encode())
+        with open(motion_file, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def load(self, motion_file):
+        entry_dir = os.path.join(self._cache_dir, self.get_key(motion_file))
+        meta_file = os.path.join(entry_dir, _META_FILE)
+        if (not os.path.exists(meta_file)):
+            return None
+
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        if (meta.get("version") != MOTION_CACHE_VERSION):
+            return None
+
+        # copy-on-write mapping, pages are shared with the file and writes never reach the disk
+        arrays = dict()
+        for name in MOTION_CACHE_ARRAYS:
+            arrays[name] = np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode="c")
+
+        return CachedMotion(arrays, meta["fps"])
+
+    def load_meta(self, motion_file):
+        # clip metadata without mapping the arrays, the joint count comes from the npy header
+        entry_dir = os.path.join(self._cache_dir, self.get_key(motion_file))
+        meta_file = os.path.join(entry_dir, _META_FILE)
+        if (not os.path.exists(meta_file)):
+            return None
+
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        if (meta.get("version") != MOTION_CACHE_VERSION):
+            return None
+
+        global_translation = np.load(os.path.join(entry_dir, "global_translation.npy"), mmap_mode="r")
+        return {"fps": meta["fps"],
+                "num_frames": meta["num_frames"],
+                "num_joints": global_translation.shape[1]}
+
+    def store(self, motion_file, motion):
+        entry_dir = os.path.join(self._cache_dir, self.get_key(motion_file))
+        if (os.path.exists(os.path.join(entry_dir, _META_FILE))):
+            return
+
+        # write into a scratch dir first so concurrent runs never see a partial entry
+        tmp_dir = None
+        try:
+            tmp_dir = tempfile.mkdtemp(dir=self._cache_dir)
+            arrays = extract_motion_arrays(motion)
+            for name in MOTION_CACHE_ARRAYS:
+                np.save(os.path.join(tmp_dir, name + ".npy"), arrays[name])
+
+            meta = {"version": MOTION_CACHE_VERSION,
+                    "source": os.path.abspath(motion_file),
+                    "skeleton": self._skeleton_key,
+                    "fps": float(motion.fps),
+                    "num_frames": int(len(motion))}
+            with open(os.path.join(tmp_dir, _META_FILE), "w") as f:
+                json.dump(meta, f)
+
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process won the race or the dir is not writable, the clip is still usable
+            if (tmp_dir is not None):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return
+
+
+def build_skeleton_key(num_dofs, dof_body_ids, dof_offsets):
+    return "dofs={:d};bodies={:s};offsets={:s}".format(num_dofs,
+                                                      ",".join(str(i) for i in dof_body_ids),
+                                                      ",".join(str(i) for i in dof_offsets))
+
+
+def extract_motion_arrays(motion):
+    arrays = dict()
+    for name in MOTION_CACHE_ARRAYS:
+        arr = getattr(motion, name)
+        if (torch.is_tensor(arr)):
+            arr = arr.cpu().numpy()
+        arrays[name] = np.ascontiguousarray(arr)
+    return arrays
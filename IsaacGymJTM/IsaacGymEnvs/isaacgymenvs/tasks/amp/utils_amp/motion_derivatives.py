@@ -0,0 +1,125 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Whole-clip time derivatives. Every function treats axis 0 as the frame axis and
+# broadcasts over the remaining ones, so one call covers all channels of a clip.
+
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+import torch
+
+from ..poselib.poselib.core.rotation3d import quat_angle_axis, quat_identity_like, quat_inverse, quat_mul_norm
+
+FD_SCHEMES = ["forward", "backward", "central"]
+
+# settings SkeletonMotion uses when it builds its root / joint velocities
+SKELETON_MOTION_SCHEME = "central"
+SKELETON_MOTION_SIGMA = 2.0
+
+
+def finite_difference(x, dt, scheme="forward"):
+    """ Time derivative of x along axis 0.
+
+    forward:  d[f] = (x[f + 1] - x[f]) / dt, last frame repeats the previous value
+    backward: d[f] = (x[f] - x[f - 1]) / dt, first frame repeats the next value
+    central:  np.gradient, one-sided differences at both ends
+    """
+    x = np.asarray(x)
+    num_frames = x.shape[0]
+    if (num_frames < 2):
+        return np.zeros_like(x, dtype=np.result_type(x, np.float32))
+
+    if (scheme == "forward"):
+        d = np.empty(x.shape, dtype=np.result_type(x, np.float32))
+        d[:-1] = (x[1:] - x[:-1]) / dt
+        d[-1] = d[-2]
+    elif (scheme == "backward"):
+        d = np.empty(x.shape, dtype=np.result_type(x, np.float32))
+        d[1:] = (x[1:] - x[:-1]) / dt
+        d[0] = d[1]
+    elif (scheme == "central"):
+        d = np.gradient(x, axis=0) / dt
+    else:
+        print("Unsupported finite difference scheme: {:s}".format(scheme))
+        assert(False)
+
+    return d
+
+
+def smooth(x, sigma):
+    if (sigma <= 0.0):
+        return x
+    return gaussian_filter1d(x, sigma, axis=0, mode="nearest")
+
+
+def compute_velocity(x, dt, scheme="forward", smoothing_sigma=0.0):
+    return smooth(finite_difference(x, dt, scheme), smoothing_sigma)
+
+
+def compute_angular_velocity(rot, dt, smoothing_sigma=SKELETON_MOTION_SIGMA):
+    # quaternion difference to the next frame, last frame gets zero velocity as in SkeletonMotion
+    rot = torch.as_tensor(rot)
+    diff_quat = quat_identity_like(rot)
+    diff_quat[:-1] = quat_mul_norm(rot[1:], quat_inverse(rot[:-1]))
+    diff_angle, diff_axis = quat_angle_axis(diff_quat)
+    ang_vel = (diff_axis * diff_angle.unsqueeze(-1) / dt).numpy()
+    return smooth(ang_vel, smoothing_sigma)
+
+
+def compute_root_velocity(root_pos, dt):
+    return compute_velocity(root_pos, dt, SKELETON_MOTION_SCHEME, SKELETON_MOTION_SIGMA)
+
+
+def compute_motion_derivatives(motion, scheme="forward", smoothing_sigma=0.0,
+                               compute_root_vels=False, compute_accelerations=False):
+    """ Derived channels for a whole clip.
+
+    Returns a dict with ``dof_vels`` and, on request, ``root_vel`` / ``root_ang_vel``
+    (recomputed the way SkeletonMotion does) and ``dof_accs`` / ``root_accs`` /
+    ``root_ang_accs``, which reuse ``scheme`` and ``smoothing_sigma``.
+    """
+    dt = 1.0 / motion.fps
+    out = dict()
+    out["dof_vels"] = compute_velocity(np.asarray(motion.q_pos), dt, scheme, smoothing_sigma)
+
+    if (compute_root_vels):
+        out["root_vel"] = compute_root_velocity(motion.global_translation[:, 0].numpy(), dt)
+        out["root_ang_vel"] = compute_angular_velocity(motion.global_rotation[:, 0], dt)
+
+    if (compute_accelerations):
+        if (compute_root_vels):
+            root_vel = out["root_vel"]
+            root_ang_vel = out["root_ang_vel"]
+        else:
+            root_vel = np.asarray(motion.global_root_velocity)
+            root_ang_vel = np.asarray(motion.global_root_angular_velocity)
+        out["dof_accs"] = compute_velocity(out["dof_vels"], dt, scheme, smoothing_sigma)
+        out["root_accs"] = compute_velocity(root_vel, dt, scheme, smoothing_sigma)
+        out["root_ang_accs"] = compute_velocity(root_ang_vel, dt, scheme, smoothing_sigma)
+
+    return out
@@ -26,11 +26,18 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
 import numpy as np
 import os
 import yaml
 
 from ..poselib.poselib.skeleton.skeleton3d import SkeletonMotion
+from .motion_cache import CachedMotion, MotionCache, build_skeleton_key, extract_motion_arrays
+from .motion_derivatives import compute_motion_derivatives, compute_velocity
+from .motion_sampler import AliasSampler, build_generator, resolve_seed
 from ..poselib.poselib.core.rotation3d import *
 from isaacgym.torch_utils import *
 from isaacgymenvs.utils.torch_jit_utils import *
@@ -48,13 +55,50 @@ from tasks.amp.atlas_amp_base import DOF_BODY_IDS, DOF_OFFSETS
 #               1, -1, 1, 1, 1, 1, 1, 1, 1, 1,
 #               1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
 class MotionLib():
-    def __init__(self, motion_file, num_dofs, key_body_ids, device):
+    def __init__(self, motion_file, num_dofs, key_body_ids, device, packed=False, cache_dir=None, num_load_workers=0,
+                 vel_scheme="forward", vel_smoothing=0.0, compute_accelerations=False, sampler_seed=None,
+                 dof_body_ids=None, dof_offsets=None, grp_bank_file=None):
         self._num_dof = num_dofs
         self._key_body_ids = key_body_ids
         self._device = device
-        self._load_motions(motion_file)
 
-        self.motion_ids = torch.arange(len(self._motions), dtype=torch.long, device=self._device)
+        # skeleton spec, defaults to the Atlas layout for callers that do not pass one
+        self._dof_body_ids = DOF_BODY_IDS if dof_body_ids is None else dof_body_ids
+        self._dof_offsets = DOF_OFFSETS if dof_offsets is None else dof_offsets
+        self._build_dof_index_tensors()
+
+        self._packed = packed
+        self._num_load_workers = num_load_workers
+        self._vel_scheme = vel_scheme
+        self._vel_smoothing = vel_smoothing
+        self._compute_accelerations = compute_accelerations
+        self._amp_obs_table = None
+        self._packed_parts = None
+
+        self._motion_cache = None
+        if (cache_dir is not None):
+            # dof_vels are cached too, so the derivative settings are part of the key
+            skeleton_key = build_skeleton_key(num_dofs, self._dof_body_ids, self._dof_offsets)
+            skeleton_key += ";vel={:s},{:g}".format(vel_scheme, vel_smoothing)
+            self._motion_cache = MotionCache(cache_dir, skeleton_key)
+
+        if (grp_bank_file is not None):
+            self._load_motions_GRP(motion_file, grp_bank_file)
+        else:
+            self._load_motions(motion_file)
+
+        self.motion_ids = torch.arange(self.num_motions(), dtype=torch.long, device=self._device)
+
+        self._motion_num_frames_tensor = to_torch(self._motion_num_frames, dtype=torch.long, device=self._device)
+        self._motion_lengths_tensor = to_torch(self._motion_lengths, dtype=torch.float, device=self._device)
+        self._motion_dt_tensor = to_torch(self._motion_dt, dtype=torch.float, device=self._device)
+
+        self._sampler_seed = resolve_seed(sampler_seed)
+        self._generator = build_generator(self._device, self._sampler_seed)
+        self._motion_sampler = AliasSampler(self._motion_weights, self._device, self._generator)
+
+        if (self._packed):
+            self._build_packed_frames()
 
         return
 
@@ -64,6 +108,9 @@ class MotionLib():
     def get_total_length(self):
         return sum(self._motion_lengths)
 
+    def get_motion_files(self):
+        return list(self._motion_files)
+
     def get_motion(self, motion_id):
         return self._motions[motion_id]
 
@@ -86,10 +133,45 @@ class MotionLib():
 
         return motion_time
 
+    def derive_generator(self, stream_id):
+        # a generator of its own for a background sampler, seeded from the sampler seed so the draws
+        # of the main thread do not depend on when the other thread runs
+        return build_generator(self._device, self._sampler_seed + stream_id)
+
+    def sample_motions_tensor(self, n, generator=None):
+        # device-side counterpart of sample_motions, never synchronises with the host
+        return self._motion_sampler.sample(n, generator)
+
+    def sample_time_tensor(self, motion_ids, truncate_time=None, generator=None):
+        if (generator is None):
+            generator = self._generator
+        phase = torch.rand(motion_ids.shape, generator=generator, device=self._device)
+
+        motion_len = self._motion_lengths_tensor[motion_ids]
+        if (truncate_time is not None):
+            assert(truncate_time >= 0.0)
+            motion_len = motion_len - truncate_time
+
+        motion_time = phase * motion_len
+
+        return motion_time
+
     def get_motion_length(self, motion_ids):
         return self._motion_lengths[motion_ids]
 
+    def update(self):
+        # called once per env step, clip sets are static here
+        return
+
     def get_motion_state(self, motion_ids, motion_times):
+        if (self._packed):
+            return self._get_packed_motion_state(motion_ids, motion_times)
+
+        if (torch.is_tensor(motion_ids)):
+            motion_ids = motion_ids.cpu().numpy()
+        if (torch.is_tensor(motion_times)):
+            motion_times = motion_times.cpu().numpy()
+
         n = len(motion_ids)
         num_bodies = self._get_num_bodies()
         num_key_bodies = self._key_body_ids.shape[0]
@@ -176,6 +258,147 @@ class MotionLib():
 
         return root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos
 
+    def build_amp_obs_table(self, amp_obs_fn, chunk_size=65536):
+        # AMP observations only depend on the reference frame, so evaluate amp_obs_fn
+        # (root_states, dof_pos, dof_vel, key_pos) -> obs once for every frame of every clip
+        if (not hasattr(self, "_frame_root_pos")):
+            self._build_packed_frames()
+
+        root_states = torch.cat([self._frame_root_pos, self._frame_root_rot,
+                                 self._frame_root_vel, self._frame_root_ang_vel], dim=-1)
+        num_frames = root_states.shape[0]
+
+        amp_obs_table = []
+        for start in range(0, num_frames, chunk_size):
+            end = min(start + chunk_size, num_frames)
+            amp_obs = amp_obs_fn(root_states[start:end], self._frame_dof_pos[start:end],
+                                 self._frame_dof_vel[start:end], self._frame_key_pos[start:end])
+            amp_obs_table.append(amp_obs)
+        self._amp_obs_table = torch.cat(amp_obs_table, dim=0)
+
+        print("Built AMP observation table with {:d} frames of {:d} features.".format(num_frames, self._amp_obs_table.shape[-1]))
+        return
+
+    def has_amp_obs_table(self):
+        return self._amp_obs_table is not None
+
+    def get_amp_obs(self, motion_ids, motion_times):
+        # features of neighbouring frames are blended linearly, which is not exactly the
+        # observation of the slerped state but agrees to first order in the frame spacing
+        f0, f1, blend = self._calc_packed_frame_ids(motion_ids, motion_times)
+        blend = blend.unsqueeze(-1)
+
+        amp_obs0 = self._amp_obs_table[f0]
+        amp_obs1 = self._amp_obs_table[f1]
+        amp_obs = (1.0 - blend) * amp_obs0 + blend * amp_obs1
+
+        return amp_obs
+
+    def _calc_packed_frame_ids(self, motion_ids, motion_times):
+        motion_ids = self._to_device_tensor(motion_ids, torch.long)
+        motion_times = self._to_device_tensor(motion_times, torch.float)
+
+        motion_len = self._motion_lengths_tensor[motion_ids]
+        num_frames = self._motion_num_frames_tensor[motion_ids]
+        dt = self._motion_dt_tensor[motion_ids]
+
+        frame_idx0, frame_idx1, blend = self._calc_frame_blend_tensor(motion_times, motion_len, num_frames, dt)
+
+        start_idx = self._motion_start_idx[motion_ids]
+        f0 = start_idx + frame_idx0
+        f1 = start_idx + frame_idx1
+
+        return f0, f1, blend
+
+    def _get_packed_motion_state(self, motion_ids, motion_times):
+        f0, f1, blend = self._calc_packed_frame_ids(motion_ids, motion_times)
+
+        blend = blend.unsqueeze(-1)
+        blend_exp = blend.unsqueeze(-1)
+
+        root_pos0 = self._frame_root_pos[f0]
+        root_pos1 = self._frame_root_pos[f1]
+        root_pos = (1.0 - blend) * root_pos0 + blend * root_pos1
+
+        root_rot = slerp(self._frame_root_rot[f0], self._frame_root_rot[f1], blend)
+
+        key_pos0 = self._frame_key_pos[f0]
+        key_pos1 = self._frame_key_pos[f1]
+        key_pos = (1.0 - blend_exp) * key_pos0 + blend_exp * key_pos1
+
+        dof_pos0 = self._frame_dof_pos[f0]
+        dof_pos1 = self._frame_dof_pos[f1]
+        dof_pos = (1.0 - blend) * dof_pos0 + blend * dof_pos1
+
+        root_vel = self._frame_root_vel[f0]
+        root_ang_vel = self._frame_root_ang_vel[f0]
+        dof_vel = self._frame_dof_vel[f0]
+
+        return root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos
+
+    def _pack_motion(self, curr_motion):
+        # appends one clip's per-frame data to the host-side pack, clips must arrive in id order
+        if (self._packed_parts is None):
+            self._packed_parts = {
+                "root_pos": [],
+                "root_rot": [],
+                "root_vel": [],
+                "root_ang_vel": [],
+                "dof_pos": [],
+                "dof_vel": [],
+                "key_pos": [],
+            }
+
+        parts = self._packed_parts
+        key_body_ids = torch.as_tensor(self._key_body_ids, dtype=torch.long)
+
+        parts["root_pos"].append(curr_motion.global_translation[:, 0].to(torch.float))
+        parts["root_rot"].append(curr_motion.global_rotation[:, 0].to(torch.float))
+        parts["root_vel"].append(curr_motion.global_root_velocity.to(torch.float))
+        parts["root_ang_vel"].append(curr_motion.global_root_angular_velocity.to(torch.float))
+        parts["key_pos"].append(curr_motion.global_translation[:, key_body_ids].to(torch.float))
+        parts["dof_pos"].append(torch.as_tensor(np.asarray(curr_motion.q_pos), dtype=torch.float))
+        parts["dof_vel"].append(torch.as_tensor(np.asarray(curr_motion.dof_vels), dtype=torch.float))
+
+        return
+
+    def _build_packed_frames(self):
+        # concatenate every clip into flat per-frame tensors on the sim device,
+        # clip i occupies frames [_motion_start_idx[i], _motion_start_idx[i] + _motion_num_frames[i])
+        if (self._packed_parts is None):
+            for curr_motion in self._motions:
+                self._pack_motion(curr_motion)
+
+        parts = self._packed_parts
+        self._packed_parts = None
+
+        root_pos = parts["root_pos"]
+        root_rot = parts["root_rot"]
+        root_vel = parts["root_vel"]
+        root_ang_vel = parts["root_ang_vel"]
+        dof_pos = parts["dof_pos"]
+        dof_vel = parts["dof_vel"]
+        key_pos = parts["key_pos"]
+
+        self._frame_root_pos = torch.cat(root_pos, dim=0).to(self._device, torch.float)
+        self._frame_root_rot = torch.cat(root_rot, dim=0).to(self._device, torch.float)
+        self._frame_root_vel = torch.cat(root_vel, dim=0).to(self._device, torch.float)
+        self._frame_root_ang_vel = torch.cat(root_ang_vel, dim=0).to(self._device, torch.float)
+        self._frame_key_pos = torch.cat(key_pos, dim=0).to(self._device, torch.float)
+        self._frame_dof_vel = torch.cat(dof_vel, dim=0).to(self._device)
+
+        # q_pos is stored as euler angles, convert once here instead of on every query
+        self._frame_dof_pos = self._euler_dof_to_angle_axis_dof(torch.cat(dof_pos, dim=0).to(self._device))
+
+        self._motion_start_idx = torch.cumsum(self._motion_num_frames_tensor, dim=0) - self._motion_num_frames_tensor
+
+        return
+
+    def _to_device_tensor(self, x, dtype):
+        if (torch.is_tensor(x)):
+            return x.to(device=self._device, dtype=dtype)
+        return torch.as_tensor(np.asarray(x), dtype=dtype, device=self._device)
+
     def _load_motions(self, motion_file):
         self._motions = []
         self._motion_lengths = []
@@ -188,26 +411,24 @@ class MotionLib():
         total_len = 0.0
 
         motion_files, motion_weights = self._fetch_motion_files(motion_file)
-        num_motion_files = len(motion_files)
-        for f in range(num_motion_files):
+
+        for f, curr_motion in self._iter_motion_files(motion_files):
             curr_file = motion_files[f]
-            print("Loading {:d}/{:d} motion files: {:s}".format(f + 1, num_motion_files, curr_file))
-            curr_motion = SkeletonMotion.from_file(curr_file)
             motion_fps = curr_motion.fps
             curr_dt = 1.0 / motion_fps
 
-            num_frames = curr_motion.tensor.shape[0]
+            num_frames = len(curr_motion)
             curr_len = 1.0 / motion_fps * (num_frames - 1)
 
             self._motion_fps.append(motion_fps)
             self._motion_dt.append(curr_dt)
             self._motion_num_frames.append(num_frames)
- 
-            curr_dof_vels = self._compute_motion_dof_vels(curr_motion)
-            curr_motion.dof_vels = curr_dof_vels
 
             self._motions.append(curr_motion)
             self._motion_lengths.append(curr_len)
+
+            if (self._packed):
+                self._pack_motion(curr_motion)
             
             curr_weight = motion_weights[f]
             self._motion_weights.append(curr_weight)
@@ -229,7 +450,92 @@ class MotionLib():
 
         return
     
-    def _load_motions_GRP(self, motion_file):
+    def _load_motion_file(self, motion_file):
+        curr_motion = None
+        if (self._motion_cache is not None):
+            curr_motion = self._motion_cache.load(motion_file)
+
+        if (curr_motion is None):
+            curr_motion = SkeletonMotion.from_file(motion_file)
+            curr_dof_vels = self._compute_motion_dof_vels(curr_motion)
+            curr_motion.dof_vels = curr_dof_vels
+
+            if (self._motion_cache is not None):
+                # evaluates the forward kinematics once so it never has to run again for this file
+                self._motion_cache.store(motion_file, curr_motion)
+
+        if (self._compute_accelerations):
+            self._compute_motion_accelerations(curr_motion)
+
+        return curr_motion
+
+    def _iter_motion_files(self, motion_files):
+        # yields (file index, clip) in file order, so clip ids never depend on worker scheduling
+        num_motion_files = len(motion_files)
+        if (self._num_load_workers <= 1 or num_motion_files <= 1):
+            for f in range(num_motion_files):
+                print("Loading {:d}/{:d} motion files: {:s}".format(f + 1, num_motion_files, motion_files[f]))
+                yield f, self._load_motion_file(motion_files[f])
+            return
+
+        cached = [None] * num_motion_files
+        pending = []
+        for f in range(num_motion_files):
+            if (self._motion_cache is not None):
+                cached[f] = self._motion_cache.load(motion_files[f])
+            if (cached[f] is None):
+                pending.append(f)
+
+        num_workers = min(self._num_load_workers, len(pending))
+        print("Loading {:d} motion files ({:d} cached) with {:d} workers".format(num_motion_files,
+                                                                             num_motion_files - len(pending),
+                                                                             num_workers))
+        if (num_workers == 0):
+            for f in range(num_motion_files):
+                yield f, self._finish_loaded_motion(cached[f])
+                cached[f] = None
+            return
+
+        # the parent already holds cuda and gym state that must not be forked, spawned workers
+        # re-import this module and only run the top-level loader below
+        mp_context = multiprocessing.get_context("spawn")
+        load_fn = functools.partial(_load_motion_arrays, vel_scheme=self._vel_scheme, vel_smoothing=self._vel_smoothing)
+        max_in_flight = 2 * num_workers
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context,
+                                                    initializer=_init_load_worker) as pool:
+            # a bounded window of decodes is in flight, each clip is handed on as soon as it is
+            # consumed instead of the whole dataset being collected first
+            in_flight = collections.deque()
+            next_pending = 0
+            for f in range(num_motion_files):
+                while (next_pending < len(pending) and len(in_flight) < max_in_flight):
+                    in_flight.append(pool.submit(load_fn, motion_files[pending[next_pending]]))
+                    next_pending += 1
+
+                curr_motion = cached[f]
+                cached[f] = None
+                if (curr_motion is None):
+                    arrays, fps = in_flight.popleft().result()
+                    curr_motion = CachedMotion(arrays, fps)
+                    if (self._motion_cache is not None):
+                        self._motion_cache.store(motion_files[f], curr_motion)
+                        # keep the memory-mapped entry so the decoded arrays can be released
+                        mapped_motion = self._motion_cache.load(motion_files[f])
+                        if (mapped_motion is not None):
+                            curr_motion = mapped_motion
+
+                yield f, self._finish_loaded_motion(curr_motion)
+
+        return
+
+    def _finish_loaded_motion(self, curr_motion):
+        if (self._compute_accelerations):
+            self._compute_motion_accelerations(curr_motion)
+        return curr_motion
+
+    def _load_motions_GRP(self, motion_file, bank_file):
+        # every trajectory in the bank is the base clip with its q_pos swapped out, so the
+        # base is parsed (and its forward kinematics run) once and shared by all of them
         self._motions = []
         self._motion_lengths = []
         self._motion_weights = []
@@ -238,36 +544,41 @@ class MotionLib():
         self._motion_num_frames = []
         self._motion_files = []
 
-        total_len = 0.0
-
         motion_files, motion_weights = self._fetch_motion_files(motion_file)
-        # num_motion_files = len(motion_files)
-        sampled_trajs = np.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../../assets/amp/motions/VAAI_GRP2.npy"))
-        for f in range(sampled_trajs.shape[0]):
-            curr_file = motion_files[0]
-            print("Loading {:d}/{:d} motion files: {:s}".format(f + 1, sampled_trajs.shape[0], curr_file))
-            curr_motion = SkeletonMotion.from_file(curr_file)
-            curr_motion.set_q_pos(sampled_trajs[f])
-            motion_fps = curr_motion.fps
-            curr_dt = 1.0 / motion_fps
-
-            num_frames = curr_motion.tensor.shape[0]
-            curr_len = 1.0 / motion_fps * (num_frames - 1)
+        base_file = motion_files[0]
+        print("Loading base motion file: {:s}".format(base_file))
+        base_motion = self._load_motion_file(base_file)
+        base_arrays = extract_motion_arrays(base_motion)
+
+        sampled_trajs = np.load(bank_file)
+        num_trajs = sampled_trajs.shape[0]
+        num_frames = len(base_motion)
+        assert(sampled_trajs.shape[1] == num_frames), \
+            "bank trajectories have {:d} frames, base motion has {:d}".format(sampled_trajs.shape[1], num_frames)
+        print("Loading {:d} trajectories from motion bank: {:s}".format(num_trajs, bank_file))
+
+        motion_fps = base_motion.fps
+        curr_dt = 1.0 / motion_fps
+        curr_len = 1.0 / motion_fps * (num_frames - 1)
+
+        # batched over trajectories, the frame axis has to come first for the derivative engine
+        traj_dof_vels = compute_velocity(np.swapaxes(sampled_trajs, 0, 1), curr_dt,
+                                         self._vel_scheme, self._vel_smoothing)
+        traj_dof_vels = np.ascontiguousarray(np.swapaxes(traj_dof_vels, 0, 1))
+
+        for f in range(num_trajs):
+            arrays = dict(base_arrays)
+            arrays["q_pos"] = sampled_trajs[f]
+            arrays["dof_vels"] = traj_dof_vels[f]
+            curr_motion = CachedMotion(arrays, motion_fps)
 
+            self._motions.append(curr_motion)
             self._motion_fps.append(motion_fps)
             self._motion_dt.append(curr_dt)
             self._motion_num_frames.append(num_frames)
- 
-            curr_dof_vels = self._compute_motion_dof_vels(curr_motion)
-            curr_motion.dof_vels = curr_dof_vels
-
-            self._motions.append(curr_motion)
             self._motion_lengths.append(curr_len)
-            
-            curr_weight = motion_weights[0]
-            self._motion_weights.append(curr_weight)
-            self._motion_files.append(curr_file)
-
+            self._motion_weights.append(motion_weights[0])
+            self._motion_files.append(base_file)
 
         self._motion_lengths = np.array(self._motion_lengths)
         self._motion_weights = np.array(self._motion_weights)
@@ -284,7 +595,6 @@ class MotionLib():
 
         return
 
-
     def _fetch_motion_files(self, motion_file):
         ext = os.path.splitext(motion_file)[1]
         if (ext == ".yaml"):
@@ -320,125 +630,150 @@ class MotionLib():
 
         return frame_idx0, frame_idx1, blend
 
+    def _calc_frame_blend_tensor(self, time, len, num_frames, dt):
+        phase = time / len
+        phase = torch.clip(phase, 0.0, 1.0)
+
+        frame_idx0 = (phase * (num_frames - 1)).long()
+        frame_idx1 = torch.min(frame_idx0 + 1, num_frames - 1)
+        blend = (time - frame_idx0 * dt) / dt
+
+        return frame_idx0, frame_idx1, blend
+
     def _get_num_bodies(self):
         motion = self.get_motion(0)
         num_bodies = motion.num_joints
         return num_bodies
 
     def _compute_motion_dof_vels(self, motion):
-        # num_frames = motion.tensor.shape[0]
-        # dt = 1.0 / motion.fps
-        # dof_vels = []
-
-        # for f in range(num_frames - 1):
-        #     local_rot0 = motion.local_rotation[f]
-        #     local_rot1 = motion.local_rotation[f + 1]
-        #     frame_dof_vel = self._local_rotation_to_dof_vel(local_rot0, local_rot1, dt)
-        #     frame_dof_vel = frame_dof_vel
-        #     dof_vels.append(frame_dof_vel)
-        
-        # dof_vels.append(dof_vels[-1])
-        # dof_vels = np.array(dof_vels)
-        num_frames = motion.tensor.shape[0]
-        dt = 1.0 / motion.fps
-        dof_vels = []
-
-        for f in range(num_frames - 1):
-            q_pos0 = motion.q_pos[f]
-            q_pos1 = motion.q_pos[f+1]
-            dof_vel = (q_pos1 - q_pos0) / dt
-            dof_vels.append(dof_vel)
+        return compute_motion_dof_vels(motion, self._vel_scheme, self._vel_smoothing)
 
-        dof_vels.append(dof_vels[-1])
-        dof_vels = np.array(dof_vels)
-        return dof_vels
+    def _compute_motion_accelerations(self, motion):
+        dt = 1.0 / motion.fps
+        motion.dof_accs = compute_velocity(motion.dof_vels, dt, self._vel_scheme, self._vel_smoothing)
+        motion.root_accs = compute_velocity(np.asarray(motion.global_root_velocity), dt, self._vel_scheme, self._vel_smoothing)
+        motion.root_ang_accs = compute_velocity(np.asarray(motion.global_root_angular_velocity), dt,
+                                                self._vel_scheme, self._vel_smoothing)
+        return
     
-    def _local_rotation_to_dof(self, local_rot):
-        body_ids = DOF_BODY_IDS
-        dof_offsets = DOF_OFFSETS
-
-        n = local_rot.shape[0]
-        dof_pos = torch.zeros((n, self._num_dof), dtype=torch.float, device=self._device)
-
-        for j in range(len(body_ids)):
-            body_id = body_ids[j]
-            joint_offset = dof_offsets[j]
-            joint_size = dof_offsets[j + 1] - joint_offset
+    def _build_dof_index_tensors(self):
+        # split the joints into hinge (1 dof) and spherical (3 dof, rpy) groups once, so the
+        # conversion kernels below work on whole groups instead of looping over joints
+        hinge_body_ids = []
+        hinge_dof_ids = []
+        sphere_body_ids = []
+        sphere_dof_ids = []
+
+        for j in range(len(self._dof_body_ids)):
+            body_id = self._dof_body_ids[j]
+            joint_offset = self._dof_offsets[j]
+            joint_size = self._dof_offsets[j + 1] - joint_offset
 
             if (joint_size == 3):
-                joint_q = local_rot[:, body_id]
-                joint_exp_map = quat_to_exp_map(joint_q)
-                dof_pos[:, joint_offset:(joint_offset + joint_size)] = joint_exp_map
+                sphere_body_ids.append(body_id)
+                sphere_dof_ids.append([joint_offset, joint_offset + 1, joint_offset + 2])
             elif (joint_size == 1):
-                joint_q = local_rot[:, body_id]
-                joint_theta, joint_axis = quat_to_angle_axis(joint_q)
-                joint_theta = joint_theta * joint_axis[..., 1] # assume joint is always along y axis TODO l5vd5
-                #TODO: l5vd5
-
-                joint_theta = normalize_angle(joint_theta)
-                dof_pos[:, joint_offset] = joint_theta
-
+                hinge_body_ids.append(body_id)
+                hinge_dof_ids.append(joint_offset)
             else:
                 print("Unsupported joint type")
                 assert(False)
 
+        self._hinge_body_ids = torch.tensor(hinge_body_ids, dtype=torch.long, device=self._device)
+        self._hinge_dof_ids = torch.tensor(hinge_dof_ids, dtype=torch.long, device=self._device)
+        self._sphere_body_ids = torch.tensor(sphere_body_ids, dtype=torch.long, device=self._device)
+        self._sphere_dof_ids = torch.tensor(sphere_dof_ids, dtype=torch.long, device=self._device).view(-1, 3)
+
+        return
+
+    def _local_rotation_to_dof(self, local_rot):
+        dof_pos = local_rotation_to_dof(local_rot.to(self._device), self._hinge_body_ids, self._hinge_dof_ids,
+                                        self._sphere_body_ids, self._sphere_dof_ids, self._num_dof)
         return dof_pos
 
     def _local_rotation_to_dof_vel(self, local_rot0, local_rot1, dt):
-        body_ids = DOF_BODY_IDS
-        dof_offsets = DOF_OFFSETS
+        # accepts a single frame [num_bodies, 4] or a batch [n, num_bodies, 4]
+        single_frame = (local_rot0.dim() == 2)
+        if (single_frame):
+            local_rot0 = local_rot0.unsqueeze(0)
+            local_rot1 = local_rot1.unsqueeze(0)
+
+        dof_vel = local_rotation_to_dof_vel(local_rot0.to(self._device), local_rot1.to(self._device), dt,
+                                            self._hinge_body_ids, self._hinge_dof_ids,
+                                            self._sphere_body_ids, self._sphere_dof_ids, self._num_dof)
+        if (single_frame):
+            dof_vel = dof_vel[0]
 
-        dof_vel = np.zeros([self._num_dof])
+        return dof_vel
+    
+    # yoon0_0
+    def _euler_dof_to_angle_axis_dof(self, euler):
+        dof_pos = euler_dof_to_angle_axis_dof(euler.to(self._device), self._hinge_dof_ids, self._sphere_dof_ids,
+                                              self._num_dof)
+        return dof_pos
 
-        diff_quat_data = quat_mul_norm(quat_inverse(local_rot0), local_rot1)
-        diff_angle, diff_axis = quat_angle_axis(diff_quat_data)
-        local_vel = diff_axis * diff_angle.unsqueeze(-1) / dt
-        local_vel = local_vel.numpy()
 
-        for j in range(len(body_ids)):
-            body_id = body_ids[j]
-            joint_offset = dof_offsets[j]
-            joint_size = dof_offsets[j + 1] - joint_offset
+def compute_motion_dof_vels(motion, scheme="forward", smoothing_sigma=0.0):
+    # one vectorized difference over the whole clip, the defaults reproduce the former
+    # per-frame (q_pos[f + 1] - q_pos[f]) / dt loop with the last frame repeated
+    derivatives = compute_motion_derivatives(motion, scheme=scheme, smoothing_sigma=smoothing_sigma)
+    return derivatives["dof_vels"]
 
-            if (joint_size == 3):
-                joint_vel = local_vel[body_id]
-                dof_vel[joint_offset:(joint_offset + joint_size)] = joint_vel
 
-            elif (joint_size == 1):
-                assert(joint_size == 1)
-                joint_vel = local_vel[body_id]
-                dof_vel[joint_offset] = joint_vel[JOINT_AXIS[j]]# * JOINT_SIGN[j] # assume joint is always along y axis TODO l5vd5
+def _init_load_worker():
+    # one intra-op thread per worker, parallelism comes from the pool
+    torch.set_num_threads(1)
+    return
 
-            else:
-                print("Unsupported joint type")
-                assert(False)
 
-        return dof_vel
-    
-    # yoon0_0
-    def _euler_dof_to_angle_axis_dof(self, euler):
-        body_ids = DOF_BODY_IDS
-        dof_offsets = DOF_OFFSETS
+def _load_motion_arrays(motion_file, vel_scheme="forward", vel_smoothing=0.0):
+    curr_motion = SkeletonMotion.from_file(motion_file)
+    curr_motion.dof_vels = compute_motion_dof_vels(curr_motion, vel_scheme, vel_smoothing)
+    arrays = extract_motion_arrays(curr_motion)
+    return arrays, curr_motion.fps
 
-        n = euler.shape[0]
-        dof_pos = torch.zeros((n, self._num_dof), dtype=torch.float, device=self._device)
 
-        for j in range(len(body_ids)):
-            body_id = body_ids[j]
-            joint_offset = dof_offsets[j]
-            joint_size = dof_offsets[j + 1] - joint_offset
+#####################################################################
+###=========================jit functions=========================###
+#####################################################################
 
-            if (joint_size == 3):
-                rpy = euler[:,joint_offset:(joint_offset + joint_size)]
-                # joint_quat = quat_from_euler_xyz(rpy[:,0],rpy[:,1],rpy[:,2])
-                joint_exp_map = euler_xyz_to_exp_map(rpy[:,0],rpy[:,1],rpy[:,2])
-                dof_pos[:, joint_offset:(joint_offset + joint_size)] = joint_exp_map
-            elif (joint_size == 1):
-                joint_euler = euler[:,joint_offset]
-                dof_pos[:, joint_offset] = joint_euler
+@torch.jit.script
+def euler_dof_to_angle_axis_dof(euler, hinge_dof_ids, sphere_dof_ids, num_dof):
+    # type: (Tensor, Tensor, Tensor, int) -> Tensor
+    euler = euler.to(torch.float)
+    dof_pos = torch.zeros((euler.shape[0], num_dof), dtype=torch.float, device=euler.device)
 
-            else:
-                print("Unsupported joint type")
-                assert(False)
+    dof_pos[:, hinge_dof_ids] = euler[:, hinge_dof_ids]
+
+    rpy = euler[:, sphere_dof_ids]
+    dof_pos[:, sphere_dof_ids] = euler_xyz_to_exp_map(rpy[..., 0], rpy[..., 1], rpy[..., 2])
+
+    return dof_pos
+
+@torch.jit.script
+def local_rotation_to_dof(local_rot, hinge_body_ids, hinge_dof_ids, sphere_body_ids, sphere_dof_ids, num_dof):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, int) -> Tensor
+    dof_pos = torch.zeros((local_rot.shape[0], num_dof), dtype=torch.float, device=local_rot.device)
+
+    sphere_q = local_rot[:, sphere_body_ids]
+    dof_pos[:, sphere_dof_ids] = quat_to_exp_map(sphere_q)
+
+    hinge_q = local_rot[:, hinge_body_ids]
+    hinge_theta, hinge_axis = quat_to_angle_axis(hinge_q)
+    hinge_theta = hinge_theta * hinge_axis[..., 1] # assume joint is always along y axis TODO l5vd5
+    dof_pos[:, hinge_dof_ids] = normalize_angle(hinge_theta)
+
+    return dof_pos
+
+@torch.jit.script
+def local_rotation_to_dof_vel(local_rot0, local_rot1, dt, hinge_body_ids, hinge_dof_ids, sphere_body_ids, sphere_dof_ids, num_dof):
+    # type: (Tensor, Tensor, float, Tensor, Tensor, Tensor, Tensor, int) -> Tensor
+    diff_quat = normalize(quat_mul(quat_conjugate(local_rot0), local_rot1))
+    diff_angle, diff_axis = quat_to_angle_axis(diff_quat)
+    local_vel = diff_axis * diff_angle.unsqueeze(-1) / dt
+
+    dof_vel = torch.zeros((local_rot0.shape[0], num_dof), dtype=torch.float, device=local_rot0.device)
+    dof_vel[:, sphere_dof_ids] = local_vel[:, sphere_body_ids]
+    dof_vel[:, hinge_dof_ids] = local_vel[:, hinge_body_ids, 1] # assume joint is always along y axis TODO l5vd5
 
-        return dof_pos
\ No newline at end of file
+    return dof_vel
@@ -0,0 +1,111 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import functools
+import os
+
+from .motion_lib import MotionLib
+from .streaming_motion_lib import StreamingMotionLib
+from .ref_state_pool import RefStatePool
+
+# offsets from the sampler seed of the generators owned by background samplers
+AMP_DEMO_GENERATOR_ID = 1
+REF_STATE_POOL_GENERATOR_ID = 2
+
+
+def build_motion_lib(env_cfg, motion_file, num_dofs, key_body_ids, device, dof_body_ids, dof_offsets):
+    # relative cache dirs are resolved next to the motion files
+    motion_cache_dir = env_cfg.get("motionCacheDir", None)
+    if (motion_cache_dir is not None):
+        motion_cache_dir = os.path.join(os.path.dirname(motion_file), motion_cache_dir)
+
+    # optional bank of sampled q_pos trajectories that all share the base motion
+    motion_bank_file = env_cfg.get("motionBankFile", None)
+    if (motion_bank_file is not None):
+        motion_bank_file = os.path.join(os.path.dirname(motion_file), motion_bank_file)
+
+    if (env_cfg.get("streamingMotionLib", False)):
+        motion_lib = StreamingMotionLib(motion_file=motion_file,
+                                        num_dofs=num_dofs,
+                                        key_body_ids=key_body_ids,
+                                        device=device,
+                                        max_active_motions=env_cfg.get("maxActiveMotions", 256),
+                                        rotation_interval=env_cfg.get("motionRotationInterval", 1000),
+                                        rotation_size=env_cfg.get("motionRotationSize", 1),
+                                        prefetch_size=env_cfg.get("motionPrefetchSize", 4),
+                                        cache_dir=motion_cache_dir,
+                                        num_load_workers=env_cfg.get("motionLoadWorkers", 0),
+                                        vel_scheme=env_cfg.get("motionVelScheme", "forward"),
+                                        vel_smoothing=env_cfg.get("motionVelSmoothing", 0.0),
+                                        compute_accelerations=env_cfg.get("motionAccelerations", False),
+                                        sampler_seed=env_cfg.get("motionSamplerSeed", None),
+                                        dof_body_ids=dof_body_ids,
+                                        dof_offsets=dof_offsets)
+    else:
+        motion_lib = MotionLib(motion_file=motion_file,
+                               num_dofs=num_dofs,
+                               key_body_ids=key_body_ids,
+                               device=device,
+                               packed=env_cfg.get("packedMotionLib", False),
+                               cache_dir=motion_cache_dir,
+                               num_load_workers=env_cfg.get("motionLoadWorkers", 0),
+                               vel_scheme=env_cfg.get("motionVelScheme", "forward"),
+                               vel_smoothing=env_cfg.get("motionVelSmoothing", 0.0),
+                               compute_accelerations=env_cfg.get("motionAccelerations", False),
+                               sampler_seed=env_cfg.get("motionSamplerSeed", None),
+                               dof_body_ids=dof_body_ids,
+                               dof_offsets=dof_offsets,
+                               grp_bank_file=motion_bank_file)
+    return motion_lib
+
+
+def build_ref_state_pool(env_cfg, motion_lib, sample_fn, device):
+    if (isinstance(motion_lib, StreamingMotionLib)):
+        print("Reference state pool is not supported with the streaming motion lib, sampling resets directly.")
+        return None
+
+    # the refill thread draws with a generator of its own, sample_fn takes it as a keyword
+    generator = motion_lib.derive_generator(REF_STATE_POOL_GENERATOR_ID)
+    return RefStatePool(sample_fn=functools.partial(sample_fn, generator=generator),
+                        pool_size=env_cfg.get("refStatePoolSize", 8192),
+                        device=device,
+                        refill_size=env_cfg.get("refStatePoolRefillSize", 512),
+                        prefetch_size=env_cfg.get("refStatePoolPrefetch", 4))
+
+
+def make_async_amp_demo_fetch(motion_lib, sample_fn, num_amp_obs):
+    # the streaming lib installs and evicts slots from get_motion_state, which is not thread safe
+    if (isinstance(motion_lib, StreamingMotionLib)):
+        return None
+
+    # fresh tensors drawn with a generator of its own, never the task's shared demo buffer
+    generator = motion_lib.derive_generator(AMP_DEMO_GENERATOR_ID)
+    def fetch_fn(num_samples):
+        return sample_fn(num_samples, generator=generator).view(num_samples, num_amp_obs)
+
+    return fetch_fn
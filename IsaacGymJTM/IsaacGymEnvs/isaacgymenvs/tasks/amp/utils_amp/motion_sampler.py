@@ -0,0 +1,101 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+import torch
+
+
+def build_alias_table(weights):
+    """ Vose's alias method, returns (prob, alias) so that a draw is
+    i ~ U{0..n-1}, u ~ U[0, 1), pick i if u < prob[i] else alias[i].
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    n = weights.shape[0]
+    weight_sum = np.sum(weights)
+    if (weight_sum > 0.0):
+        p = weights * n / weight_sum
+    else:
+        p = np.ones(n)
+
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+
+    small = [i for i in range(n) if p[i] < 1.0]
+    large = [i for i in range(n) if p[i] >= 1.0]
+    while (len(small) > 0 and len(large) > 0):
+        s = small.pop()
+        l = large.pop()
+
+        prob[s] = p[s]
+        alias[s] = l
+
+        p[l] = p[l] + p[s] - 1.0
+        if (p[l] < 1.0):
+            small.append(l)
+        else:
+            large.append(l)
+
+    # leftovers only differ from 1 by round-off
+    for i in small + large:
+        prob[i] = 1.0
+        alias[i] = i
+
+    return prob, alias
+
+
+class AliasSampler():
+    """ O(1) weighted categorical sampler whose tables and draws stay on the device. """
+    def __init__(self, weights, device, generator=None):
+        prob, alias = build_alias_table(weights)
+        self._num_categories = prob.shape[0]
+        self._device = device
+        self._generator = generator
+        self._prob = torch.tensor(prob, dtype=torch.float, device=device)
+        self._alias = torch.tensor(alias, dtype=torch.long, device=device)
+        return
+
+    def sample(self, n, generator=None):
+        if (generator is None):
+            generator = self._generator
+        idx = torch.randint(0, self._num_categories, (n,), generator=generator, device=self._device)
+        u = torch.rand(n, generator=generator, device=self._device)
+        samples = torch.where(u < self._prob[idx], idx, self._alias[idx])
+        return samples
+
+
+def resolve_seed(seed=None):
+    # without an explicit seed follow the global torch seed so runs stay reproducible
+    if (seed is None):
+        seed = int(torch.randint(0, 2**31 - 1, (1,)).item())
+    return seed
+
+
+def build_generator(device, seed=None):
+    generator = torch.Generator(device=device)
+    generator.manual_seed(resolve_seed(seed))
+    return generator
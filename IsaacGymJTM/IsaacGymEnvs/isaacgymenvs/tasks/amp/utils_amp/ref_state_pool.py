@@ -0,0 +1,145 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import queue
+import threading
+
+import torch
+
+
+class RefStatePool():
+    """ Device-resident pool of pre-sampled reference states for resets.
+
+    sample_fn(n) returns a dict of tensors with n rows each, e.g. the root and dof states of
+    n reference frames together with their AMP history windows. It runs on the refill thread, so
+    it has to draw from a random generator the main thread does not use. pop(n) hands out the next n
+    rows of the pool with a single gather, so a reset never queries the motion lib itself.
+
+    A background thread keeps sampling batches of ``refill_size`` rows (on its own CUDA stream
+    on a GPU) into a bounded queue. Once that many rows have been handed out, pop() writes a
+    ready batch over the oldest consumed rows. If no batch is ready the consumed rows are
+    simply handed out again, pop() never waits for the sampler.
+    """
+    def __init__(self, sample_fn, pool_size, device, refill_size=512, prefetch_size=4):
+        assert(refill_size <= pool_size), "Refill size must not exceed the pool size"
+        self._sample_fn = sample_fn
+        self._pool_size = pool_size
+        self._refill_size = refill_size
+        self._device = device
+
+        self._pool = sample_fn(pool_size)
+        self._read_cursor = 0
+        self._write_cursor = 0
+        self._num_consumed = 0
+        self._num_refills = 0
+        self._num_stale = 0
+
+        self._use_cuda = torch.device(device).type == "cuda"
+        self._stream = torch.cuda.Stream(device=device) if self._use_cuda else None
+
+        self._refill_queue = queue.Queue(maxsize=prefetch_size)
+        self._stop_event = threading.Event()
+        self._refill_thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self._refill_thread.start()
+        return
+
+    def pop(self, n):
+        self._swap_in_ready()
+
+        ids = torch.arange(self._read_cursor, self._read_cursor + n, device=self._device, dtype=torch.long)
+        ids = ids % self._pool_size
+        self._read_cursor = (self._read_cursor + n) % self._pool_size
+
+        self._num_consumed += n
+        if (self._num_consumed > self._pool_size):
+            # the sampler fell behind and rows are being handed out a second time
+            self._num_stale += self._num_consumed - self._pool_size
+            self._num_consumed = self._pool_size
+            self._write_cursor = self._read_cursor
+
+        return {k: v[ids] for k, v in self._pool.items()}
+
+    def num_refills(self):
+        return self._num_refills
+
+    def num_stale(self):
+        return self._num_stale
+
+    def close(self):
+        self._stop_event.set()
+        self._refill_thread.join()
+        return
+
+    def _swap_in_ready(self):
+        while (self._num_consumed >= self._refill_size):
+            try:
+                batch, event = self._refill_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if (event is not None):
+                stream = torch.cuda.current_stream(self._device)
+                stream.wait_event(event)
+                # the batch was allocated on the sampler stream and is released once copied
+                for v in batch.values():
+                    v.record_stream(stream)
+
+            ids = torch.arange(self._write_cursor, self._write_cursor + self._refill_size,
+                               device=self._device, dtype=torch.long)
+            ids = ids % self._pool_size
+            for k, v in self._pool.items():
+                v[ids] = batch[k]
+
+            self._write_cursor = (self._write_cursor + self._refill_size) % self._pool_size
+            self._num_consumed -= self._refill_size
+            self._num_refills += 1
+
+        return
+
+    def _sample_batch(self):
+        if (not self._use_cuda):
+            return self._sample_fn(self._refill_size), None
+
+        with torch.cuda.stream(self._stream):
+            batch = self._sample_fn(self._refill_size)
+            event = torch.cuda.Event()
+            event.record(self._stream)
+        return batch, event
+
+    def _refill_loop(self):
+        while (not self._stop_event.is_set()):
+            batch, event = self._sample_batch()
+            while (not self._stop_event.is_set()):
+                try:
+                    self._refill_queue.put((batch, event), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+        return
@@ -0,0 +1,394 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import queue
+import threading
+
+import numpy as np
+
+from .motion_lib import *
+
+
+class StreamingMotionLib(MotionLib):
+    """ MotionLib variant that keeps only a bounded set of clips resident on the device.
+
+    Only per-clip metadata is kept for the whole dataset. At most ``max_active_motions`` clips
+    live in fixed device slots and are evicted least-recently-used, by a last-used step kept per
+    slot on the device so the tensor query paths can refresh it without a sync. A background thread loads
+    candidate clips (drawn by sampling weight) into a bounded host queue, and every
+    ``rotation_interval`` calls to ``update`` up to ``rotation_size`` of them replace the LRU
+    slots, so ``sample_motions`` covers the whole dataset over time.
+
+    Loading goes through ``_load_motion_file``, so pairing this with a motion cache makes
+    re-loading an evicted clip a memory map instead of a full decode.
+    """
+    def __init__(self, motion_file, num_dofs, key_body_ids, device, max_active_motions,
+                 rotation_interval=1000, rotation_size=1, prefetch_size=4, cache_dir=None, num_load_workers=0,
+                 vel_scheme="forward", vel_smoothing=0.0, compute_accelerations=False, sampler_seed=None,
+                 dof_body_ids=None, dof_offsets=None):
+        self._max_active_motions = max_active_motions
+        self._rotation_interval = rotation_interval
+        self._rotation_size = rotation_size
+        self._prefetch_size = prefetch_size
+        self._update_count = 0
+
+        super().__init__(motion_file=motion_file, num_dofs=num_dofs, key_body_ids=key_body_ids, device=device,
+                         packed=False, cache_dir=cache_dir, num_load_workers=num_load_workers,
+                         vel_scheme=vel_scheme, vel_smoothing=vel_smoothing, compute_accelerations=compute_accelerations,
+                         sampler_seed=sampler_seed, dof_body_ids=dof_body_ids, dof_offsets=dof_offsets)
+
+        # guards the slot map and the pending set, both are read by the prefetch thread
+        self._prefetch_lock = threading.Lock()
+        self._build_slots()
+        self._fill_slots()
+
+        self._prefetch_queue = queue.Queue(maxsize=self._prefetch_size)
+        self._prefetch_pending = set()
+        self._stop_event = threading.Event()
+        self._prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._prefetch_thread.start()
+
+        return
+
+    def num_motions(self):
+        return len(self._motion_files)
+
+    def num_active_motions(self):
+        return len(self._active_slots)
+
+    def get_motion(self, motion_id):
+        return self._load_motion_file(self._motion_files[motion_id])
+
+    def sample_motions(self, n):
+        active_ids = np.fromiter(self._active_slots.keys(), dtype=np.int64)
+        weights = self._motion_weights[active_ids]
+        weight_sum = np.sum(weights)
+        if (weight_sum > 0.0):
+            weights = weights / weight_sum
+        else:
+            weights = None
+
+        motion_ids = np.random.choice(active_ids, size=n, replace=True, p=weights)
+        self._touch(motion_ids)
+
+        return motion_ids
+
+    def sample_motions_tensor(self, n, generator=None):
+        # the alias table only covers resident clips and is rebuilt lazily after a rotation
+        if (self._active_sampler is None):
+            active_ids = np.fromiter(self._active_slots.keys(), dtype=np.int64)
+            self._active_sampler = AliasSampler(self._motion_weights[active_ids], self._device, self._generator)
+            self._active_ids_tensor = to_torch(active_ids, dtype=torch.long, device=self._device)
+
+        motion_ids = self._active_ids_tensor[self._active_sampler.sample(n, generator)]
+        self._touch_slots(self._motion_slot_tensor[motion_ids])
+
+        return motion_ids
+
+    def build_amp_obs_table(self, amp_obs_fn, chunk_size=65536):
+        print("StreamingMotionLib does not keep an AMP observation table, demo observations are computed per query.")
+        return
+
+    def get_motion_state(self, motion_ids, motion_times):
+        if (torch.is_tensor(motion_ids)):
+            motion_ids = motion_ids.to(self._device, torch.long)
+            # residency is checked on the device, the ids only come back to the host when a stale
+            # clip has to be installed, and then all of them so resident ones are not evicted
+            if (torch.any(self._motion_slot_tensor[motion_ids] < 0)):
+                self._ensure_resident(motion_ids.cpu().numpy())
+        else:
+            self._ensure_resident(np.asarray(motion_ids))
+            motion_ids = self._to_device_tensor(motion_ids, torch.long)
+
+        motion_times = self._to_device_tensor(motion_times, torch.float)
+
+        motion_len = self._motion_lengths_tensor[motion_ids]
+        num_frames = self._motion_num_frames_tensor[motion_ids]
+        dt = self._motion_dt_tensor[motion_ids]
+
+        frame_idx0, frame_idx1, blend = self._calc_frame_blend_tensor(motion_times, motion_len, num_frames, dt)
+        slot_ids = self._motion_slot_tensor[motion_ids]
+        self._touch_slots(slot_ids)
+
+        blend = blend.unsqueeze(-1)
+        blend_exp = blend.unsqueeze(-1)
+
+        root_pos0 = self._slot_root_pos[slot_ids, frame_idx0]
+        root_pos1 = self._slot_root_pos[slot_ids, frame_idx1]
+        root_pos = (1.0 - blend) * root_pos0 + blend * root_pos1
+
+        root_rot = slerp(self._slot_root_rot[slot_ids, frame_idx0], self._slot_root_rot[slot_ids, frame_idx1], blend)
+
+        key_pos0 = self._slot_key_pos[slot_ids, frame_idx0]
+        key_pos1 = self._slot_key_pos[slot_ids, frame_idx1]
+        key_pos = (1.0 - blend_exp) * key_pos0 + blend_exp * key_pos1
+
+        dof_pos0 = self._slot_dof_pos[slot_ids, frame_idx0]
+        dof_pos1 = self._slot_dof_pos[slot_ids, frame_idx1]
+        dof_pos = (1.0 - blend) * dof_pos0 + blend * dof_pos1
+
+        root_vel = self._slot_root_vel[slot_ids, frame_idx0]
+        root_ang_vel = self._slot_root_ang_vel[slot_ids, frame_idx0]
+        dof_vel = self._slot_dof_vel[slot_ids, frame_idx0]
+
+        return root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos
+
+    def update(self):
+        self._update_count += 1
+        if (self._update_count % self._rotation_interval != 0):
+            return
+
+        for i in range(self._rotation_size):
+            try:
+                motion_id, clip = self._prefetch_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            with self._prefetch_lock:
+                self._prefetch_pending.discard(motion_id)
+
+            if (motion_id not in self._active_slots):
+                self._install_clip(motion_id, clip)
+
+        return
+
+    def close(self):
+        self._stop_event.set()
+        self._prefetch_thread.join()
+        return
+
+    def _load_motions(self, motion_file):
+        # only metadata is kept for the full dataset, clip data is loaded into slots on demand
+        self._motions = []
+        self._motion_lengths = []
+        self._motion_weights = []
+        self._motion_fps = []
+        self._motion_dt = []
+        self._motion_num_frames = []
+        self._motion_files = []
+
+        motion_files, motion_weights = self._fetch_motion_files(motion_file)
+        num_motion_files = len(motion_files)
+
+        motion_meta = [None] * num_motion_files
+        if (self._motion_cache is not None):
+            for f in range(num_motion_files):
+                motion_meta[f] = self._motion_cache.load_meta(motion_files[f])
+
+        # clips without a cache entry are decoded once for their metadata and dropped,
+        # with a cache this also stores them so later slot installs are memory maps
+        missing = [f for f in range(num_motion_files) if motion_meta[f] is None]
+        missing_files = [motion_files[f] for f in missing]
+        for i, curr_motion in self._iter_motion_files(missing_files):
+            motion_meta[missing[i]] = {"fps": curr_motion.fps,
+                                       "num_frames": len(curr_motion),
+                                       "num_joints": curr_motion.num_joints}
+
+        for f in range(num_motion_files):
+            motion_fps = motion_meta[f]["fps"]
+            num_frames = motion_meta[f]["num_frames"]
+
+            self._motion_fps.append(motion_fps)
+            self._motion_dt.append(1.0 / motion_fps)
+            self._motion_num_frames.append(num_frames)
+            self._motion_lengths.append(1.0 / motion_fps * (num_frames - 1))
+            self._motion_weights.append(motion_weights[f])
+            self._motion_files.append(motion_files[f])
+
+        self._num_bodies = motion_meta[0]["num_joints"]
+
+        self._motion_lengths = np.array(self._motion_lengths)
+        self._motion_weights = np.array(self._motion_weights)
+        self._motion_weights /= np.sum(self._motion_weights)
+
+        self._motion_fps = np.array(self._motion_fps)
+        self._motion_dt = np.array(self._motion_dt)
+        self._motion_num_frames = np.array(self._motion_num_frames)
+
+        print("Indexed {:d} motions with a total length of {:.3f}s, keeping {:d} resident.".format(
+            self.num_motions(), self.get_total_length(), min(self._max_active_motions, self.num_motions())))
+
+        return
+
+    def _get_num_bodies(self):
+        return self._num_bodies
+
+    def _build_slots(self):
+        num_slots = min(self._max_active_motions, self.num_motions())
+        max_frames = int(np.max(self._motion_num_frames))
+        num_key_bodies = self._key_body_ids.shape[0]
+
+        self._slot_root_pos = torch.zeros((num_slots, max_frames, 3), dtype=torch.float, device=self._device)
+        self._slot_root_rot = torch.zeros((num_slots, max_frames, 4), dtype=torch.float, device=self._device)
+        self._slot_root_vel = torch.zeros((num_slots, max_frames, 3), dtype=torch.float, device=self._device)
+        self._slot_root_ang_vel = torch.zeros((num_slots, max_frames, 3), dtype=torch.float, device=self._device)
+        self._slot_dof_pos = torch.zeros((num_slots, max_frames, self._num_dof), dtype=torch.float, device=self._device)
+        self._slot_dof_vel = torch.zeros((num_slots, max_frames, self._num_dof), dtype=torch.float, device=self._device)
+        self._slot_key_pos = torch.zeros((num_slots, max_frames, num_key_bodies, 3), dtype=torch.float, device=self._device)
+
+        self._free_slots = list(range(num_slots))
+        self._active_slots = dict()
+        self._slot_motion = np.full(num_slots, -1, dtype=np.int64)
+
+        # last use of every slot in touch steps, the least recently used slot is the argmin
+        self._slot_last_used = torch.zeros(num_slots, dtype=torch.long, device=self._device)
+        self._use_step = 0
+
+        self._motion_slot = np.full(self.num_motions(), -1, dtype=np.int64)
+        self._motion_slot_tensor = torch.full((self.num_motions(),), -1, dtype=torch.long, device=self._device)
+
+        self._active_sampler = None
+        self._active_ids_tensor = None
+
+        return
+
+    def _fill_slots(self):
+        motion_ids = self._weighted_order(np.arange(self.num_motions()))
+        for motion_id in motion_ids[:len(self._free_slots)]:
+            self._install_clip(motion_id, self._load_host_clip(motion_id))
+        return
+
+    def _weighted_order(self, motion_ids):
+        # weighted sampling without replacement via exponential keys, zero weights sort last
+        weights = self._motion_weights[motion_ids]
+        with np.errstate(divide="ignore"):
+            keys = -np.log(np.random.uniform(size=motion_ids.shape)) / weights
+        return motion_ids[np.argsort(keys)]
+
+    def _touch(self, motion_ids):
+        slot_ids = self._motion_slot[np.unique(motion_ids)]
+        self._touch_slots(to_torch(slot_ids, dtype=torch.long, device=self._device))
+        return
+
+    def _touch_slots(self, slot_ids):
+        # the step is a host counter, so refreshing recency never waits on the device
+        self._use_step += 1
+        self._slot_last_used.index_fill_(0, slot_ids, self._use_step)
+        return
+
+    def _ensure_resident(self, motion_ids):
+        motion_ids = np.unique(motion_ids)
+        assert(len(motion_ids) <= len(self._slot_root_pos)), "query touches more clips than there are slots"
+
+        resident = self._motion_slot[motion_ids] >= 0
+        self._touch(motion_ids[resident])
+
+        # ids sampled before a rotation can go stale, load them synchronously
+        for motion_id in motion_ids[~resident]:
+            self._install_clip(int(motion_id), self._load_host_clip(int(motion_id)))
+
+        return
+
+    def _install_clip(self, motion_id, clip):
+        if (len(self._free_slots) > 0):
+            slot = self._free_slots.pop()
+        else:
+            # installs are rare, the one sync for the argmin is fine here
+            slot = int(torch.argmin(self._slot_last_used))
+            evict_id = int(self._slot_motion[slot])
+            with self._prefetch_lock:
+                del self._active_slots[evict_id]
+                self._motion_slot[evict_id] = -1
+            self._motion_slot_tensor[evict_id] = -1
+
+        num_frames = clip["root_pos"].shape[0]
+        self._slot_root_pos[slot, :num_frames] = clip["root_pos"].to(self._device, non_blocking=True)
+        self._slot_root_rot[slot, :num_frames] = clip["root_rot"].to(self._device, non_blocking=True)
+        self._slot_root_vel[slot, :num_frames] = clip["root_vel"].to(self._device, non_blocking=True)
+        self._slot_root_ang_vel[slot, :num_frames] = clip["root_ang_vel"].to(self._device, non_blocking=True)
+        self._slot_dof_vel[slot, :num_frames] = clip["dof_vel"].to(self._device, non_blocking=True)
+        self._slot_key_pos[slot, :num_frames] = clip["key_pos"].to(self._device, non_blocking=True)
+        self._slot_dof_pos[slot, :num_frames] = self._euler_dof_to_angle_axis_dof(clip["q_pos"].to(self._device, non_blocking=True))
+
+        with self._prefetch_lock:
+            self._active_slots[motion_id] = slot
+            self._motion_slot[motion_id] = slot
+        self._slot_motion[slot] = motion_id
+        self._active_sampler = None
+        self._motion_slot_tensor[motion_id] = slot
+        self._touch_slots(torch.tensor([slot], dtype=torch.long, device=self._device))
+
+        return
+
+    def _load_host_clip(self, motion_id):
+        curr_motion = self._load_motion_file(self._motion_files[motion_id])
+        key_body_ids = torch.as_tensor(self._key_body_ids, dtype=torch.long)
+
+        clip = {
+            "root_pos": curr_motion.global_translation[:, 0],
+            "root_rot": curr_motion.global_rotation[:, 0],
+            "root_vel": curr_motion.global_root_velocity,
+            "root_ang_vel": curr_motion.global_root_angular_velocity,
+            "key_pos": curr_motion.global_translation[:, key_body_ids],
+            "q_pos": torch.as_tensor(np.asarray(curr_motion.q_pos)),
+            "dof_vel": torch.as_tensor(np.asarray(curr_motion.dof_vels)),
+        }
+
+        pin = torch.device(self._device).type == "cuda"
+        for k, v in clip.items():
+            v = v.to(torch.float).contiguous()
+            if (pin):
+                v = v.pin_memory()
+            clip[k] = v
+
+        return clip
+
+    def _choose_prefetch_motion(self):
+        with self._prefetch_lock:
+            candidates = [i for i in range(self.num_motions())
+                          if self._motion_slot[i] < 0 and i not in self._prefetch_pending]
+            if (len(candidates) == 0):
+                return None
+
+            candidates = np.array(candidates)
+            weights = self._motion_weights[candidates]
+            weight_sum = np.sum(weights)
+            if (weight_sum <= 0.0):
+                return None
+
+            motion_id = int(np.random.choice(candidates, p=weights / weight_sum))
+            self._prefetch_pending.add(motion_id)
+
+        return motion_id
+
+    def _prefetch_loop(self):
+        while (not self._stop_event.is_set()):
+            motion_id = self._choose_prefetch_motion()
+            if (motion_id is None):
+                self._stop_event.wait(0.1)
+                continue
+
+            clip = self._load_host_clip(motion_id)
+            while (not self._stop_event.is_set()):
+                try:
+                    self._prefetch_queue.put((motion_id, clip), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+        return
@@ -16,9 +16,11 @@ from gym import spaces
 from isaacgym import gymapi
 from isaacgym import gymtorch
 
-from .amp.atlas_amp_base import AtlasAMPBase, dof_to_obs    # modified for Atlas
+from .amp.atlas_amp_base import AtlasAMPBase, dof_to_obs, DOF_BODY_IDS, DOF_OFFSETS    # modified for Atlas
 from .amp.utils_amp import gym_util
-from .amp.utils_amp.motion_lib import MotionLib
+from .amp.utils_amp.motion_lib_builder import build_motion_lib, build_ref_state_pool, make_async_amp_demo_fetch
+from .amp.utils_amp.amp_obs_history import AMPObsHistory, LazyExtras, LazyValue
+from .amp.utils_amp.amp_demo_snapshot import build_task_snapshot_file, fetch_demo_bulk
 
 from isaacgym.torch_utils import *
 from isaacgymenvs.utils.torch_jit_utils import *
@@ -43,23 +45,34 @@ class AtlasAMP(AtlasAMPBase):
         self._hybrid_init_prob = cfg["env"]["hybridInitProb"]
         self._num_amp_obs_steps = cfg["env"]["numAMPObsSteps"]
         assert(self._num_amp_obs_steps >= 2)
+        self._fused_amp_obs = cfg["env"].get("fusedAmpObs", False)
 
         self._reset_default_env_ids = []
         self._reset_ref_env_ids = []
+        self._reset_ref_amp_obs_hist = None
 
         super().__init__(config=self.cfg, sim_device=sim_device, graphics_device_id=graphics_device_id, headless=headless)
 
         motion_file = cfg['env'].get('motion_file')
         motion_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../assets/amp/motions/" + motion_file)
+        self._motion_file = motion_file_path
         self._load_motion(motion_file_path)
+        if (self.cfg["env"].get("ampObsTable", False)):
+            self._motion_lib.build_amp_obs_table(self._compute_demo_amp_obs)
+
+        self._ref_state_pool = None
+        if (self.cfg["env"].get("refStatePool", False)):
+            self._build_ref_state_pool()
 
         self.num_amp_obs = self._num_amp_obs_steps * NUM_AMP_OBS_PER_STEP
 
         self._amp_obs_space = spaces.Box(np.ones(self.num_amp_obs) * -np.Inf, np.ones(self.num_amp_obs) * np.Inf)
 
-        self._amp_obs_buf = torch.zeros((self.num_envs, self._num_amp_obs_steps, NUM_AMP_OBS_PER_STEP), device=self.device, dtype=torch.float)
-        self._curr_amp_obs_buf = self._amp_obs_buf[:, 0]
-        self._hist_amp_obs_buf = self._amp_obs_buf[:, 1:]
+        self._amp_obs_hist = AMPObsHistory(self.num_envs, self._num_amp_obs_steps, NUM_AMP_OBS_PER_STEP, self.device,
+                                           window_order=self.cfg["env"].get("ampObsWindowOrder", "newest_first"))
+        # the flat AMP observations are only gathered from the history when extras["amp_obs"] is read
+        self.extras = LazyExtras(self.extras)
+        self._amp_obs_flat = LazyValue(self._amp_obs_hist.flat)
         
         self._amp_obs_demo_buf = None
 
@@ -67,12 +80,27 @@ class AtlasAMP(AtlasAMPBase):
 
     def post_physics_step(self):
         super().post_physics_step()
-        
-        self._update_hist_amp_obs()
-        self._compute_amp_observations()
 
-        amp_obs_flat = self._amp_obs_buf.view(-1, self.get_num_amp_obs())
-        self.extras["amp_obs"] = amp_obs_flat
+        # the AMP frame may have been written by a graph replay, which skips the history's own bookkeeping
+        self._amp_obs_hist.invalidate()
+        self._motion_lib.update()
+
+        self.extras["amp_obs"] = self._amp_obs_flat
+
+        return
+
+    def _compute_step_terms(self, profiler):
+        if (self._fused_amp_obs):
+            # the current AMP frame is written together with obs_buf, shift the history first
+            with profiler.scope("amp_observations"):
+                self._update_hist_amp_obs()
+
+        super()._compute_step_terms(profiler)
+
+        if (not self._fused_amp_obs):
+            with profiler.scope("amp_observations"):
+                self._update_hist_amp_obs()
+                self._compute_amp_observations()
 
         return
 
@@ -87,31 +115,60 @@ class AtlasAMP(AtlasAMPBase):
         return self.task.fetch_amp_obs_demo(num_samples)
 
     def fetch_amp_obs_demo(self, num_samples):
-        dt = self.dt
-        motion_ids = self._motion_lib.sample_motions(num_samples)
-
         if (self._amp_obs_demo_buf is None):
             self._build_amp_obs_demo_buf(num_samples)
         else:
             assert(self._amp_obs_demo_buf.shape[0] == num_samples)
+
+        self._amp_obs_demo_buf[:] = self._sample_amp_obs_demo(num_samples)
+
+        amp_obs_demo_flat = self._amp_obs_demo_buf.view(-1, self.get_num_amp_obs())
+        return amp_obs_demo_flat
+
+    def build_async_amp_demo_fetch(self):
+        # None when demos can only be fetched on the main thread
+        return make_async_amp_demo_fetch(self._motion_lib, self._sample_amp_obs_demo, self.get_num_amp_obs())
+
+    def fetch_amp_obs_demo_bulk(self, num_samples):
+        snapshot_config = {
+            "task": type(self).__name__,
+            "num_amp_obs_steps": self._num_amp_obs_steps,
+            "num_amp_obs_per_step": NUM_AMP_OBS_PER_STEP,
+            "dt": self.dt,
+            "local_root_obs": self._local_root_obs
+        }
+        snapshot_file = build_task_snapshot_file(self.cfg["env"], self._motion_file, self._motion_lib, snapshot_config)
+
+        return fetch_demo_bulk(self._sample_amp_obs_demo, num_samples, self.get_num_amp_obs(),
+                               batch_size=self.cfg["env"].get("ampDemoBulkBatchSize", 65536),
+                               device=self.device,
+                               snapshot_file=snapshot_file)
+
+    def _sample_amp_obs_demo(self, num_samples, generator=None):
+        dt = self.dt
+        motion_ids = self._motion_lib.sample_motions_tensor(num_samples, generator)
+
         # sample motion
-        motion_times0 = self._motion_lib.sample_time(motion_ids)
-        motion_ids = np.tile(np.expand_dims(motion_ids, axis=-1), [1, self._num_amp_obs_steps])
-        motion_times = np.expand_dims(motion_times0, axis=-1)
-        time_steps = -dt * np.arange(0, self._num_amp_obs_steps)
+        motion_times0 = self._motion_lib.sample_time_tensor(motion_ids, generator=generator)
+        motion_ids = motion_ids.unsqueeze(-1).expand(-1, self._num_amp_obs_steps)
+        motion_times = motion_times0.unsqueeze(-1)
+        time_steps = self._amp_obs_hist.window_time_offsets(dt)
         motion_times = motion_times + time_steps
 
         motion_ids = motion_ids.flatten()
         motion_times = motion_times.flatten()
-        root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos \
-               = self._motion_lib.get_motion_state(motion_ids, motion_times)
-        root_states = torch.cat([root_pos, root_rot, root_vel, root_ang_vel], dim=-1)
-        amp_obs_demo = build_amp_observations(root_states, dof_pos, dof_vel, key_pos,
-                                      self._local_root_obs)
-        self._amp_obs_demo_buf[:] = amp_obs_demo.view(self._amp_obs_demo_buf.shape)
+        if (self._motion_lib.has_amp_obs_table()):
+            amp_obs_demo = self._motion_lib.get_amp_obs(motion_ids, motion_times)
+        else:
+            root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos \
+                   = self._motion_lib.get_motion_state(motion_ids, motion_times)
+            root_states = torch.cat([root_pos, root_rot, root_vel, root_ang_vel], dim=-1)
+            amp_obs_demo = self._compute_demo_amp_obs(root_states, dof_pos, dof_vel, key_pos)
 
-        amp_obs_demo_flat = self._amp_obs_demo_buf.view(-1, self.get_num_amp_obs())
-        return amp_obs_demo_flat
+        return amp_obs_demo.view(num_samples, self._num_amp_obs_steps, NUM_AMP_OBS_PER_STEP)
+
+    def _compute_demo_amp_obs(self, root_states, dof_pos, dof_vel, key_pos):
+        return build_amp_observations(root_states, dof_pos, dof_vel, key_pos, self._local_root_obs)
 
     def _build_amp_obs_demo_buf(self, num_samples):
         self._amp_obs_demo_buf = torch.zeros((num_samples, self._num_amp_obs_steps, NUM_AMP_OBS_PER_STEP), device=self.device, dtype=torch.float)
@@ -119,11 +176,42 @@ class AtlasAMP(AtlasAMPBase):
         
 
     def _load_motion(self, motion_file):
-        self._motion_lib = MotionLib(motion_file=motion_file, 
-                                     num_dofs=self.num_dof,
-                                     key_body_ids=self._key_body_ids.cpu().numpy(), 
-                                     device=self.device)
+        self._motion_lib = build_motion_lib(self.cfg["env"], motion_file,
+                                            num_dofs=self.num_dof,
+                                            key_body_ids=self._key_body_ids.cpu().numpy(),
+                                            device=self.device,
+                                            dof_body_ids=DOF_BODY_IDS,
+                                            dof_offsets=DOF_OFFSETS)
+        return
+
+    def _build_ref_state_pool(self):
+        # only random reference frames are pooled, Start always resets to the first frame
+        if (self._state_init != AtlasAMP.StateInit.Random
+            and self._state_init != AtlasAMP.StateInit.Hybrid):
+            return
+
+        self._ref_state_pool = build_ref_state_pool(self.cfg["env"], self._motion_lib, self._sample_ref_states, self.device)
         return
+
+    def _sample_ref_states(self, num_samples, generator=None):
+        motion_ids = self._motion_lib.sample_motions_tensor(num_samples, generator)
+        motion_times = self._motion_lib.sample_time_tensor(motion_ids, generator=generator)
+        root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos \
+               = self._motion_lib.get_motion_state(motion_ids, motion_times)
+        amp_obs_hist = self._compute_amp_obs_ref_hist(motion_ids, motion_times)
+
+        ref_states = {
+            "motion_ids": motion_ids,
+            "motion_times": motion_times,
+            "root_pos": root_pos,
+            "root_rot": root_rot,
+            "dof_pos": dof_pos,
+            "root_vel": root_vel,
+            "root_ang_vel": root_ang_vel,
+            "dof_vel": dof_vel,
+            "amp_obs_hist": amp_obs_hist
+        }
+        return ref_states
     
     def reset_idx(self, env_ids):
         super().reset_idx(env_ids)
@@ -149,15 +237,13 @@ class AtlasAMP(AtlasAMPBase):
         return
     
     def _reset_default(self, env_ids):
+        actor_ids = self.humanoid_ids[env_ids]
+        self._root_states[actor_ids] = self._initial_root_states[actor_ids]
         self._dof_pos[env_ids] = self._initial_dof_pos[env_ids]
         self._dof_vel[env_ids] = self._initial_dof_vel[env_ids]
 
-        env_ids_int32 = env_ids.to(dtype=torch.int32)
-        self.gym.set_actor_root_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._initial_root_states),
-                                                     gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
-
-        self.gym.set_dof_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._dof_state),
-                                              gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
+        self.reset_transaction.stage_root_states(actor_ids)
+        self.reset_transaction.stage_dof_states(actor_ids)
 
         self._reset_default_env_ids = env_ids
         return
@@ -165,20 +251,28 @@ class AtlasAMP(AtlasAMPBase):
     # modified for Atlas
     def _reset_ref_state_init(self, env_ids):
         num_envs = env_ids.shape[0]
-        motion_ids = self._motion_lib.sample_motions(num_envs)
         # yoon0_0
         # self._reset_obstacle(env_ids=env_ids)
         self._reset_soccer_ball(env_ids=env_ids)
-        if (self._state_init == AtlasAMP.StateInit.Random
-            or self._state_init == AtlasAMP.StateInit.Hybrid):
-            motion_times = self._motion_lib.sample_time(motion_ids)
-        elif (self._state_init == AtlasAMP.StateInit.Start):
-            motion_times = np.zeros(num_envs)
+        if (self._ref_state_pool is not None):
+            ref_states = self._ref_state_pool.pop(num_envs)
+            motion_ids = ref_states["motion_ids"]
+            motion_times = ref_states["motion_times"]
+            root_pos, root_rot, dof_pos = ref_states["root_pos"], ref_states["root_rot"], ref_states["dof_pos"]
+            root_vel, root_ang_vel, dof_vel = ref_states["root_vel"], ref_states["root_ang_vel"], ref_states["dof_vel"]
+            self._reset_ref_amp_obs_hist = ref_states["amp_obs_hist"]
         else:
-            assert(False), "Unsupported state initialization strategy: {:s}".format(str(self._state_init))
-
-        root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos \
-               = self._motion_lib.get_motion_state(motion_ids, motion_times)
+            motion_ids = self._motion_lib.sample_motions_tensor(num_envs)
+            if (self._state_init == AtlasAMP.StateInit.Random
+                or self._state_init == AtlasAMP.StateInit.Hybrid):
+                motion_times = self._motion_lib.sample_time_tensor(motion_ids)
+            elif (self._state_init == AtlasAMP.StateInit.Start):
+                motion_times = torch.zeros(num_envs, device=self.device, dtype=torch.float)
+            else:
+                assert(False), "Unsupported state initialization strategy: {:s}".format(str(self._state_init))
+            root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, key_pos \
+                   = self._motion_lib.get_motion_state(motion_ids, motion_times)
+            self._reset_ref_amp_obs_hist = None
         # TODO l5vd5: to prevent from penetration
         root_pos[:,2] += 0.15
         self._set_env_state(env_ids=env_ids, 
@@ -210,26 +304,37 @@ class AtlasAMP(AtlasAMPBase):
         return
 
     def _init_amp_obs(self, env_ids):
-        self._compute_amp_observations(env_ids)
+        if (not self._fused_amp_obs):
+            self._compute_amp_observations(env_ids)
 
         if (len(self._reset_default_env_ids) > 0):
             self._init_amp_obs_default(self._reset_default_env_ids)
 
         if (len(self._reset_ref_env_ids) > 0):
-            self._init_amp_obs_ref(self._reset_ref_env_ids, self._reset_ref_motion_ids,
-                                   self._reset_ref_motion_times)
+            if (self._reset_ref_amp_obs_hist is not None):
+                # the history windows were popped from the reference state pool with the states
+                self._amp_obs_hist.set_history(self._reset_ref_amp_obs_hist, self._reset_ref_env_ids)
+            else:
+                self._init_amp_obs_ref(self._reset_ref_env_ids, self._reset_ref_motion_ids,
+                                       self._reset_ref_motion_times)
         return
 
     def _init_amp_obs_default(self, env_ids):
-        curr_amp_obs = self._curr_amp_obs_buf[env_ids].unsqueeze(-2)
-        self._hist_amp_obs_buf[env_ids] = curr_amp_obs
+        self._amp_obs_hist.fill_history(env_ids)
         return
 
     def _init_amp_obs_ref(self, env_ids, motion_ids, motion_times):
+        amp_obs_hist = self._compute_amp_obs_ref_hist(motion_ids, motion_times)
+        self._amp_obs_hist.set_history(amp_obs_hist, env_ids)
+        return
+
+    def _compute_amp_obs_ref_hist(self, motion_ids, motion_times):
+        # (len(motion_ids), num_amp_obs_steps - 1, obs_size), the previous frame first
+        num_samples = motion_ids.shape[0]
         dt = self.dt
-        motion_ids = np.tile(np.expand_dims(motion_ids, axis=-1), [1, self._num_amp_obs_steps - 1])
-        motion_times = np.expand_dims(motion_times, axis=-1)
-        time_steps = -dt * (np.arange(0, self._num_amp_obs_steps - 1) + 1)
+        motion_ids = motion_ids.unsqueeze(-1).expand(-1, self._num_amp_obs_steps - 1)
+        motion_times = motion_times.unsqueeze(-1)
+        time_steps = -dt * (torch.arange(0, self._num_amp_obs_steps - 1, device=self.device, dtype=torch.float) + 1)
         motion_times = motion_times + time_steps
 
         motion_ids = motion_ids.flatten()
@@ -239,53 +344,48 @@ class AtlasAMP(AtlasAMPBase):
         root_states = torch.cat([root_pos, root_rot, root_vel, root_ang_vel], dim=-1)
         amp_obs_demo = build_amp_observations(root_states, dof_pos, dof_vel, key_pos,
                                       self._local_root_obs)
-        self._hist_amp_obs_buf[env_ids] = amp_obs_demo.view(self._hist_amp_obs_buf[env_ids].shape)
-        return
+        return amp_obs_demo.view(num_samples, self._num_amp_obs_steps - 1, -1)
     
     def _set_env_state(self, env_ids, root_pos, root_rot, dof_pos, root_vel, root_ang_vel, dof_vel, collision_test=True):
         # Added from JTM, humanoid states
-        self._root_states[self.humanoid_ids[env_ids], 0:3] = root_pos
-        self._root_states[self.humanoid_ids[env_ids], 3:7] = root_rot
-        self._root_states[self.humanoid_ids[env_ids], 7:10] = root_vel
-        self._root_states[self.humanoid_ids[env_ids], 10:13] = root_ang_vel
+        self.humanoid_states[env_ids, 0:3] = root_pos
+        self.humanoid_states[env_ids, 3:7] = root_rot
+        self.humanoid_states[env_ids, 7:10] = root_vel
+        self.humanoid_states[env_ids, 10:13] = root_ang_vel
         
         self._dof_pos[env_ids] = dof_pos
         self._dof_vel[env_ids] = dof_vel
 
         # Added from JTM
-        env_ids_int32 = self.humanoid_ids[env_ids].to(dtype=torch.int32)
-        # env_obstacle_ids_int32 = torch.cat([self.ball_ids[env_ids],self.box_ids[env_ids]],dim=1).to(dtype=torch.int32)
-        # env_all_ids_int32 = torch.cat([env_ids_int32.reshape(-1, 1),env_obstacle_ids_int32],dim=1).to(dtype=torch.int32).flatten()
-
-        self.gym.set_actor_root_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._root_states), 
-                                                    gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
-        self.gym.set_dof_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._dof_state),
-                                                    gymtorch.unwrap_tensor(env_ids_int32), len(env_ids_int32))
-        
-        # Added from JTM
-        # Error: sequential reset method got stuck in error
-        # self._reset_balls(env_ids)
-        # self._reset_boxs(env_ids)
+        actor_ids = self.humanoid_ids[env_ids]
+        self.reset_transaction.stage_root_states(actor_ids)
+        self.reset_transaction.stage_dof_states(actor_ids)
+
+        # obstacles go out in the same indexed call as the humanoid
+        if (self.num_balls > 0):
+            self._reset_balls(env_ids)
+        if (self.num_boxs > 0):
+            self._reset_boxs(env_ids)
         return
     
     def _reset_obstacle(self, env_ids):
         env_box_ids_int32 = self.box_ids[env_ids].to(dtype=torch.int32)
         env_ball_ids_int32 = self.ball_ids[env_ids].to(dtype=torch.int32)
         env_obstacle_ids_int32 = torch.cat([self.box_ids[env_ids],self.ball_ids[env_ids]],dim=1).to(dtype=torch.int32).flatten()
-        self._root_states[self.ball_ids[env_ids], :] = self._ball_buffer[self.ball_ids[env_ids], :]
+        self.ball_states[env_ids] = self._initial_ball_states[env_ids]
         # self.gym.set_actor_root_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._root_states),
         #                                 gymtorch.unwrap_tensor(env_ball_ids_int32), len(env_ball_ids_int32))
 
-        self._root_states[self.box_ids[env_ids], :] = self._box_buffer[self.box_ids[env_ids], :]
+        self.box_states[env_ids] = self._initial_box_states[env_ids]
         # self.gym.set_actor_root_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._root_states),
         #                                 gymtorch.unwrap_tensor(env_box_ids_int32), len(env_box_ids_int32))
 
+        init_humanoid_pos = self._initial_root_states[self.humanoid_ids[env_ids], 0:3].unsqueeze(-2)
         if self.num_balls > 0:
-            self._root_states[self.ball_ids[env_ids].flatten(), 7:10] = (self._initial_root_states[self.humanoid_ids[env_ids], 0:3].repeat((self.num_balls,1)).reshape(len(env_ids)*self.num_balls,3)-self._ball_buffer[self.ball_ids[env_ids].flatten(), 0:3]) * 5 # velocity
+            self.ball_states[env_ids, :, 7:10] = (init_humanoid_pos-self._initial_ball_states[env_ids, :, 0:3]) * 5 # velocity
         if self.num_boxs > 0:
-            self._root_states[self.box_ids[env_ids].flatten(), 7:10] = (self._initial_root_states[self.humanoid_ids[env_ids], 0:3].repeat((self.num_boxs,1)).reshape(len(env_ids)*self.num_boxs,3)-self._box_buffer[self.ball_ids[env_ids].flatten(), 0:3]) * 5 # velocity
-        self.gym.set_actor_root_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._root_states),
-                                                gymtorch.unwrap_tensor(env_obstacle_ids_int32), len(env_obstacle_ids_int32))
+            self.box_states[env_ids, :, 7:10] = (init_humanoid_pos-self._initial_box_states[env_ids, :, 0:3]) * 5 # velocity
+        self.reset_transaction.stage_root_states(env_obstacle_ids_int32)
 
         # time.sleep(1)
         # return env_obstacle_ids_int32
@@ -293,51 +393,62 @@ class AtlasAMP(AtlasAMPBase):
     # Added from JTM
     def _reset_soccer_ball(self, env_ids):
         env_soccer_ball_ids_int32 = self.soccer_ball_id[env_ids].to(dtype=torch.int32)
-        self._root_states[self.soccer_ball_id[env_ids], :] = self._ball_buffer[self.soccer_ball_id[env_ids], :]
+        self.soccer_ball_states[env_ids] = self._initial_soccer_ball_states[env_ids]
 
         # reference
         #self._ball_buffer[env_ids,0] = 4.0*torch.rand(len(env_ids), device=self.device) + 2.5
-        self.gym.set_actor_root_state_tensor_indexed(self.sim, gymtorch.unwrap_tensor(self._root_states),
-                                                gymtorch.unwrap_tensor(env_soccer_ball_ids_int32), len(env_soccer_ball_ids_int32))
+        self.reset_transaction.stage_root_states(env_soccer_ball_ids_int32)
         return env_soccer_ball_ids_int32
 
     # Added from JTM
     def _reset_balls(self, env_ids):
         env_ball_ids_int32 = self.ball_ids[env_ids].to(dtype=torch.int32)
-        self._root_states[self.ball_ids[env_ids], :] = self._ball_buffer[self.ball_ids[env_ids], :]
-        self._root_states[self.ball_ids[env_ids], 7:10] = (self._root_states[self.humanoid_ids[env_ids], 0:3]-self._root_states[self.ball_ids[env_ids], 0:3]) * 10# velocity
+        self.ball_states[env_ids] = self._initial_ball_states[env_ids]
+        self.ball_states[env_ids, :, 7:10] = (self.humanoid_states[env_ids, 0:3].unsqueeze(-2)-self.ball_states[env_ids, :, 0:3]) * 10# velocity
 
         # reference
         #self._ball_buffer[env_ids,0] = 4.0*torch.rand(len(env_ids), device=self.device) + 2.5
-
+        self.reset_transaction.stage_root_states(env_ball_ids_int32)
         return env_ball_ids_int32
     
     # Added from JTM
     def _reset_boxs(self, env_ids):
         env_box_ids_int32 = self.box_ids[env_ids].to(dtype=torch.int32)
-        self._root_states[self.box_ids[env_ids], :] = self._box_buffer[self.box_ids[env_ids], :]
-        self._root_states[self.box_ids[env_ids], 7:10] = (self._root_states[self.humanoid_ids[env_ids], 0:3]-self._root_states[self.box_ids[env_ids], 0:3]) * 10# velocity
+        self.box_states[env_ids] = self._initial_box_states[env_ids]
+        self.box_states[env_ids, :, 7:10] = (self.humanoid_states[env_ids, 0:3].unsqueeze(-2)-self.box_states[env_ids, :, 0:3]) * 10# velocity
 
         # reference
         #self._ball_buffer[env_ids,0] = 4.0*torch.rand(len(env_ids), device=self.device) + 2.5
+        self.reset_transaction.stage_root_states(env_box_ids_int32)
         return env_box_ids_int32
 
+    def _get_sim_tensor_consumers(self):
+        consumers = super()._get_sim_tensor_consumers()
+        # key body positions
+        consumers["amp_observations"] = ["rigid_body_state"]
+        return consumers
+
+    def _compute_humanoid_obs(self, env_ids=None):
+        obs = super()._compute_humanoid_obs(env_ids)
+        if (self._fused_amp_obs):
+            # build_amp_observations produces the same features, reuse them for the current AMP frame
+            self._amp_obs_hist.set_current(obs, env_ids)
+        return obs
+
     def _update_hist_amp_obs(self, env_ids=None):
-        if (env_ids is None):
-            self._hist_amp_obs_buf[:] = self._amp_obs_buf[:, 0:(self._num_amp_obs_steps - 1)]
-        else:
-            self._hist_amp_obs_buf[env_ids] = self._amp_obs_buf[env_ids, 0:(self._num_amp_obs_steps - 1)]
+        self._amp_obs_hist.advance(env_ids)
         return
     
     def _compute_amp_observations(self, env_ids=None):
         key_body_pos = self._rigid_body_pos[:, self._key_body_ids, :]
         if (env_ids is None):
-            self._curr_amp_obs_buf[:] = build_amp_observations(self._root_states[self.humanoid_ids], self._dof_pos, self._dof_vel, key_body_pos,
-                                                                self._local_root_obs)
+            amp_obs = build_amp_observations(self.humanoid_states, self._dof_pos, self._dof_vel, key_body_pos,
+                                             self._local_root_obs)
         else:
-            self._curr_amp_obs_buf[env_ids] = build_amp_observations(self._root_states[self.humanoid_ids[env_ids]], self._dof_pos[env_ids], 
-                                                                    self._dof_vel[env_ids], key_body_pos[env_ids],
-                                                                    self._local_root_obs)
+            amp_obs = build_amp_observations(self.humanoid_states[env_ids], self._dof_pos[env_ids], 
+                                             self._dof_vel[env_ids], key_body_pos[env_ids],
+                                             self._local_root_obs)
+        self._amp_obs_hist.set_current(amp_obs, env_ids)
         return
 
 
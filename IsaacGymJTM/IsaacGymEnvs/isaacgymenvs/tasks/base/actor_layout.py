@@ -0,0 +1,102 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import torch
+
+
+class ActorLayout():
+    """ Actors every env of a task is built from, registered once in creation order.
+
+    Every env creates the same actors in the same order, so the flat gym tensors are env major:
+    the root state tensor is (num_envs * num_actors, 13) and the rigid body state and contact
+    force tensors are (num_envs * num_bodies, k). Actors of one group are created back to back,
+    which makes the states of a group a strided slice of the env major view and no gather is
+    needed to read or write them.
+
+        layout.add_actor("humanoid", num_humanoid_bodies)
+        layout.add_actor("ball", 1)
+        ...
+        ball_states = layout.root_states(root_tensor, "ball")   # (num_envs, num_balls, 13)
+    """
+    def __init__(self):
+        self.num_actors = 0
+        self.num_bodies = 0
+        # group -> [first actor, num actors, first body, num bodies per actor]
+        self._groups = dict()
+        return
+
+    def add_actor(self, group, num_bodies):
+        if (group in self._groups):
+            entry = self._groups[group]
+            assert(entry[0] + entry[1] == self.num_actors), "Actors of group {:s} must be created back to back".format(group)
+            assert(entry[3] == num_bodies), "Actors of group {:s} must have the same number of bodies".format(group)
+            entry[1] += 1
+        else:
+            self._groups[group] = [self.num_actors, 1, self.num_bodies, num_bodies]
+
+        self.num_actors += 1
+        self.num_bodies += num_bodies
+        return
+
+    def has_group(self, group):
+        return group in self._groups
+
+    def num_group_actors(self, group):
+        return self._actor_range(group)[1]
+
+    def num_group_bodies(self, group):
+        return self._body_range(group)[1]
+
+    def actor_ids(self, group, num_envs, device):
+        # (num_envs, num actors in the group) global actor indices, as used by the indexed gym calls
+        start, count = self._actor_range(group)
+        env_offsets = torch.arange(num_envs, device=device, dtype=torch.long).unsqueeze(-1) * self.num_actors
+        return env_offsets + torch.arange(start, start + count, device=device, dtype=torch.long)
+
+    def root_states(self, root_tensor, group):
+        # (num_envs, num actors in the group, 13) view
+        start, count = self._actor_range(group)
+        return root_tensor.view(-1, self.num_actors, root_tensor.shape[-1])[:, start:start + count]
+
+    def body_states(self, body_tensor, group):
+        # (num_envs, num bodies of the group, k) view of a rigid body state or contact force tensor
+        start, count = self._body_range(group)
+        return body_tensor.view(-1, self.num_bodies, body_tensor.shape[-1])[:, start:start + count]
+
+    def _actor_range(self, group):
+        if (group not in self._groups):
+            return self.num_actors, 0
+        entry = self._groups[group]
+        return entry[0], entry[1]
+
+    def _body_range(self, group):
+        if (group not in self._groups):
+            return self.num_bodies, 0
+        entry = self._groups[group]
+        return entry[2], entry[1] * entry[3]
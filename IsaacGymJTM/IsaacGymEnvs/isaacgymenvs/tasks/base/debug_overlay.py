@@ -0,0 +1,86 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from isaacgym import gymtorch
+
+import numpy as np
+import torch
+
+
+class ContactDebugOverlay():
+    """ Draws the net contact force of every rigid body as a line from the body origin.
+
+    Line segments for all selected envs are assembled on the sim device and copied to the
+    host in one transfer, then handed to the viewer with one add_lines call per env.
+    """
+    def __init__(self, gym, sim, viewer, envs, num_envs, num_bodies, device,
+                 env_ids=(0,), interval=1, force_scale=0.001, min_force=0.0, color=(1.0, 1.0, 1.0)):
+        self._gym = gym
+        self._sim = sim
+        self._viewer = viewer
+        self._num_bodies = num_bodies
+        self._interval = max(int(interval), 1)
+        self._force_scale = force_scale
+        self._min_force = min_force
+        self._step_count = 0
+
+        env_ids = [i for i in env_ids if (i >= 0 and i < num_envs)]
+        self._envs = [envs[i] for i in env_ids]
+        self._env_ids = torch.tensor(env_ids, dtype=torch.long, device=device)
+
+        contact_force_tensor = gym.acquire_net_contact_force_tensor(sim)
+        rigid_body_state_tensor = gym.acquire_rigid_body_state_tensor(sim)
+        self._contact_forces = gymtorch.wrap_tensor(contact_force_tensor).view(num_envs, num_bodies, 3)
+        self._rigid_body_pos = gymtorch.wrap_tensor(rigid_body_state_tensor).view(num_envs, num_bodies, 13)[..., 0:3]
+
+        self._colors = np.tile(np.array(color, dtype=np.float32), (num_bodies, 1))
+        return
+
+    def draw(self):
+        step = self._step_count
+        self._step_count += 1
+        if (step % self._interval != 0 or len(self._envs) == 0):
+            return
+
+        self._gym.refresh_net_contact_force_tensor(self._sim)
+        self._gym.refresh_rigid_body_state_tensor(self._sim)
+
+        p0 = self._rigid_body_pos[self._env_ids]
+        forces = self._contact_forces[self._env_ids]
+        if (self._min_force > 0.0):
+            active = torch.norm(forces, dim=-1, keepdim=True) > self._min_force
+            forces = forces * active
+        p1 = p0 + self._force_scale * forces
+
+        # single device-to-host copy for every line drawn this frame
+        lines = torch.cat([p0, p1], dim=-1).cpu().numpy().astype(np.float32)
+
+        self._gym.clear_lines(self._viewer)
+        for env, env_lines in zip(self._envs, lines):
+            self._gym.add_lines(self._viewer, env, self._num_bodies, env_lines, self._colors)
+        return
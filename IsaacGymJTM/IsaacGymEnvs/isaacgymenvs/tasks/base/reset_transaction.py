@@ -0,0 +1,74 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from isaacgym import gymtorch
+
+import torch
+
+
+class ResetTransaction():
+    """ Actor resets collected from the reset helpers of a task and pushed to the sim together.
+
+    Helpers write new states into the task's root state and dof state tensors and stage the
+    global actor indices they touched. commit() then issues a single indexed root-state call
+    and a single indexed dof-state call for everything staged since the previous commit.
+    """
+    def __init__(self, gym, sim):
+        self._gym = gym
+        self._sim = sim
+        self._root_actor_ids = []
+        self._dof_actor_ids = []
+        return
+
+    def stage_root_states(self, actor_ids):
+        self._root_actor_ids.append(actor_ids.flatten().to(dtype=torch.int32))
+        return
+
+    def stage_dof_states(self, actor_ids):
+        self._dof_actor_ids.append(actor_ids.flatten().to(dtype=torch.int32))
+        return
+
+    def has_pending(self):
+        return len(self._root_actor_ids) > 0 or len(self._dof_actor_ids) > 0
+
+    def commit(self, root_states, dof_state):
+        if (len(self._root_actor_ids) > 0):
+            actor_ids = torch.cat(self._root_actor_ids)
+            if (len(actor_ids) > 0):
+                self._gym.set_actor_root_state_tensor_indexed(self._sim, gymtorch.unwrap_tensor(root_states),
+                                                              gymtorch.unwrap_tensor(actor_ids), len(actor_ids))
+
+        if (len(self._dof_actor_ids) > 0):
+            actor_ids = torch.cat(self._dof_actor_ids)
+            if (len(actor_ids) > 0):
+                self._gym.set_dof_state_tensor_indexed(self._sim, gymtorch.unwrap_tensor(dof_state),
+                                                       gymtorch.unwrap_tensor(actor_ids), len(actor_ids))
+
+        self._root_actor_ids = []
+        self._dof_actor_ids = []
+        return
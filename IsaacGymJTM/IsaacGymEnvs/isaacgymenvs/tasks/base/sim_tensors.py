@@ -0,0 +1,101 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import torch
+
+# sim tensors a task can declare, named after the gym refresh calls
+SIM_TENSORS = ["actor_root_state", "dof_state", "rigid_body_state", "net_contact_force", "force_sensor", "dof_force"]
+
+# resets write these back to the sim, so they are refreshed whether declared or not
+ALWAYS_REFRESHED = ["actor_root_state", "dof_state"]
+
+
+class StaleSimTensor():
+    """ Stands in for a task attribute backed by a sim tensor that is not refreshed. Any use fails. """
+    def __init__(self, sim_tensor, attr):
+        self._sim_tensor = sim_tensor
+        self._attr = attr
+        return
+
+    def _fail(self):
+        raise RuntimeError("{:s} reads the {:s} sim tensor, which no term declared and is never refreshed".format(
+            self._attr, self._sim_tensor))
+
+    def __getattr__(self, name):
+        self._fail()
+
+    def __getitem__(self, key):
+        self._fail()
+
+    @classmethod
+    def __torch_function__(cls, func, types, args=(), kwargs=None):
+        stale = [a for a in args if isinstance(a, StaleSimTensor)]
+        if (kwargs is not None):
+            stale += [a for a in kwargs.values() if isinstance(a, StaleSimTensor)]
+        stale[0]._fail()
+
+
+class SimTensorRefresher():
+    """ Refreshes the sim tensors the task's terms declared they read, and nothing else.
+
+    consumers maps a term (observations, reward, reset, ...) to the sim tensors it reads.
+    With debug enabled, guard() swaps every task attribute backed by an undeclared sim tensor
+    for a StaleSimTensor, so a term that reads one fails at the read instead of silently using
+    values from whenever the tensor was last refreshed.
+    """
+    def __init__(self, gym, sim, consumers, debug=False):
+        self._sim = sim
+        self.debug = debug
+
+        declared = set(ALWAYS_REFRESHED)
+        for term, sim_tensors in consumers.items():
+            for name in sim_tensors:
+                assert(name in SIM_TENSORS), "Unknown sim tensor {:s} declared by {:s}".format(name, term)
+                declared.add(name)
+
+        self.refreshed = [name for name in SIM_TENSORS if name in declared]
+        self._refresh_fns = [getattr(gym, "refresh_{:s}_tensor".format(name)) for name in self.refreshed]
+        return
+
+    def refresh(self):
+        for refresh_fn in self._refresh_fns:
+            refresh_fn(self._sim)
+        return
+
+    def guard(self, task, attrs):
+        # attrs maps a sim tensor to the task attributes that are views of it
+        if (not self.debug):
+            return
+
+        for name, task_attrs in attrs.items():
+            if (name in self.refreshed):
+                continue
+            for attr in task_attrs:
+                setattr(task, attr, StaleSimTensor(name, attr))
+        return
@@ -0,0 +1,66 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import torch
+
+
+class StepGraph():
+    """ Replays a fixed-shape step callable from a CUDA graph.
+
+    The first ``warmup_calls`` calls run eagerly, the next one is captured and every later call
+    replays the captured kernels. Intermediates live in the graph's private memory pool, so a
+    replay never requests memory from the caching allocator. The callable may only touch tensors
+    that keep their storage from step to step and must not synchronise with the host. Python side
+    effects in it only happen while it runs eagerly or is captured.
+    """
+    def __init__(self, fn, warmup_calls=3):
+        self._fn = fn
+        self._warmup_calls = warmup_calls
+        self._num_calls = 0
+        self._graph = None
+        return
+
+    def __call__(self):
+        if (self._graph is not None):
+            self._graph.replay()
+            return
+
+        if (self._num_calls < self._warmup_calls):
+            # lets the jit settle on its optimized graphs before they are captured
+            self._num_calls += 1
+            self._fn()
+            return
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            self._fn()
+        self._graph = graph
+
+        # capture only records the kernels, run them for this step
+        self._graph.replay()
+        return
@@ -35,6 +35,11 @@ from isaacgym import gymtorch, gymapi, gymutil
 from isaacgym.torch_utils import to_torch
 from isaacgym.gymutil import get_property_setter_map, get_property_getter_map, get_default_setter_args, apply_random_samples, check_buckets, generate_random_samples
 
+from isaacgymenvs.utils.profiler import NULL_PROFILER
+
+from .debug_overlay import ContactDebugOverlay
+from .reset_transaction import ResetTransaction
+
 import torch
 import numpy as np
 import operator, random
@@ -97,6 +102,10 @@ class Env(ABC):
         self.clip_obs = config["env"].get("clipObservations", np.Inf)
         self.clip_actions = config["env"].get("clipActions", np.Inf)
 
+        # run step on persistent buffers and in-place kernels only, the returned tensors are overwritten by the next step,
+        # tasks that support it replay their step terms from a CUDA graph
+        self.static_step_buffers = config["env"].get("staticStepBuffers", False)
+
     @abc.abstractmethod 
     def allocate_buffers(self):
         """Create torch buffers for observations, rewards, actions dones and any additional data."""
@@ -179,6 +188,7 @@ class VecTask(Env):
         torch._C._jit_set_profiling_executor(False)
 
         self.gym = gymapi.acquire_gym()
+        self.profiler = NULL_PROFILER
 
         self.first_randomization = True
         self.original_props = {}
@@ -196,7 +206,11 @@ class VecTask(Env):
         self.gym.prepare_sim(self.sim)
         self.sim_initialized = True
 
+        # reset helpers stage actor states here, reset_idx flushes them in one call per state tensor
+        self.reset_transaction = ResetTransaction(self.gym, self.sim)
+
         self.set_viewer()
+        self.set_debug_overlay()
         self.allocate_buffers()
 
         self.obs_dict = {}
@@ -230,6 +244,24 @@ class VecTask(Env):
             self.gym.viewer_camera_look_at(
                 self.viewer, None, cam_pos, cam_target)
 
+    def set_profiler(self, profiler):
+        """Share the step profiler of the training loop with the env."""
+        self.profiler = profiler
+
+    def set_debug_overlay(self):
+        """Create the contact force overlay, only when enabled in the config and a viewer exists."""
+
+        self.contact_debug_overlay = None
+        if self.viewer is None or not self.cfg["env"].get("contactDebugVis", False):
+            return
+
+        self.contact_debug_overlay = ContactDebugOverlay(
+            self.gym, self.sim, self.viewer, self.envs, self.num_envs, self.num_bodies, self.device,
+            env_ids=self.cfg["env"].get("contactDebugVisEnvs", [0]),
+            interval=self.cfg["env"].get("contactDebugVisInterval", 1),
+            force_scale=self.cfg["env"].get("contactDebugVisForceScale", 0.001),
+            min_force=self.cfg["env"].get("contactDebugVisMinForce", 0.0))
+
     def allocate_buffers(self):
         """Allocate the observation, states, etc. buffers.
 
@@ -257,6 +289,34 @@ class VecTask(Env):
             self.num_envs, device=self.device, dtype=torch.long)
         self.extras = {}
 
+        if self.static_step_buffers:
+            self._step_actions = torch.zeros(
+                (self.num_envs, self.num_actions), device=self.rl_device, dtype=torch.float)
+            self._timeout_flags = torch.zeros(
+                self.num_envs, device=self.device, dtype=torch.bool)
+            self._clipped_obs_buf = torch.zeros_like(self.obs_buf)
+            self._rl_obs_buf = self._rl_device_buffer(self._clipped_obs_buf)
+            self._rl_rew_buf = self._rl_device_buffer(self.rew_buf)
+            self._rl_reset_buf = self._rl_device_buffer(self.reset_buf)
+            self._rl_timeout_buf = self._rl_device_buffer(self.timeout_buf)
+
+    def _rl_device_buffer(self, buf):
+        """Returns `buf` when it already lives on the rl device, otherwise a persistent rl device copy of it."""
+        if buf.device == torch.device(self.rl_device):
+            return buf
+        return torch.zeros_like(buf, device=self.rl_device)
+
+    def _write_static_outputs(self):
+        """Clip the observations and copy the step outputs into the persistent rl device buffers."""
+        torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs, out=self._clipped_obs_buf)
+        for src, dst in ((self._clipped_obs_buf, self._rl_obs_buf), (self.rew_buf, self._rl_rew_buf),
+                         (self.reset_buf, self._rl_reset_buf), (self.timeout_buf, self._rl_timeout_buf)):
+            if dst is not src:
+                dst.copy_(src)
+
+        self.obs_dict["obs"] = self._rl_obs_buf
+        self.extras["time_outs"] = self._rl_timeout_buf
+
     def create_sim(self, compute_device: int, graphics_device: int, physics_engine, sim_params: gymapi.SimParams):
         """Create an Isaac Gym sim object.
 
@@ -305,30 +365,18 @@ class VecTask(Env):
         if self.dr_randomizations.get('actions', None):
             actions = self.dr_randomizations['actions']['noise_lambda'](actions)
 
-        action_tensor = torch.clamp(actions, -self.clip_actions, self.clip_actions)
+        if self.static_step_buffers:
+            action_tensor = torch.clamp(actions, -self.clip_actions, self.clip_actions, out=self._step_actions)
+        else:
+            action_tensor = torch.clamp(actions, -self.clip_actions, self.clip_actions)
         # apply actions
-        self.pre_physics_step(action_tensor)
+        with self.profiler.scope("pre_physics_step"):
+            self.pre_physics_step(action_tensor)
 
         # step physics and render each frame
         for i in range(self.control_freq_inv):
-            # yoon0_0 : visualize contact
-            self.gym.clear_lines(self.viewer)
-            net_contact_force_tensor = self.gym.acquire_net_contact_force_tensor(self.sim)
-            net_contact_force_tensor = gymtorch.wrap_tensor(net_contact_force_tensor).view(self.num_envs, self.num_bodies,3)[0,:,:]
-            joint_pos = self.gym.acquire_rigid_body_state_tensor(self.sim)
-            joint_pos = gymtorch.wrap_tensor(joint_pos).view(self.num_envs, self.num_bodies, 13)[0,:,0:3]
-            for i, (p1, p2) in enumerate(zip(joint_pos, net_contact_force_tensor)):
-                # print(self.gym.get_joint_name(self.envs[0], i))
-                # if torch.all(p2 == 0):
-                #     continue
-                p1 = p1.cpu().numpy()
-                p2 = p2.cpu().numpy() / 1000
-                
-                p2 = gymapi.Vec3(p1[0] + p2[0], p1[1] + p2[1], p1[2] + p2[2])
-                p1 = gymapi.Vec3(p1[0], p1[1], p1[2])
-                color = gymapi.Vec3(1., 1., 1.)
-                gymutil.draw_line(p1, p2, color, self.gym, self.viewer, self.envs[0])
-            # self.gym.draw_env_rigid_contacts(self.viewer, self.envs[0], gymapi.Vec3(1., 1., 1.), 1.,  True)
+            if self.contact_debug_overlay is not None and self.enable_viewer_sync:
+                self.contact_debug_overlay.draw()
 
             # yoon0_0: save axis angle
             # print(self.gym.get_elapsed_time(self.sim))
@@ -337,23 +385,36 @@ class VecTask(Env):
             # if len(self.axis_angle_list) == 200:
             #     print('full')
 
-            self.render()
-            self.gym.simulate(self.sim)
+            with self.profiler.scope("render"):
+                self.render()
+            with self.profiler.scope("simulate"):
+                self.gym.simulate(self.sim)
 
         # to fix!
         if self.device == 'cpu':
             self.gym.fetch_results(self.sim, True)
 
         # fill time out buffer
-        self.timeout_buf = torch.where(self.progress_buf >= self.max_episode_length - 1, torch.ones_like(self.timeout_buf), torch.zeros_like(self.timeout_buf))
+        if self.static_step_buffers:
+            torch.ge(self.progress_buf, self.max_episode_length - 1, out=self._timeout_flags)
+            self.timeout_buf.copy_(self._timeout_flags)
+        else:
+            self.timeout_buf = torch.where(self.progress_buf >= self.max_episode_length - 1, torch.ones_like(self.timeout_buf), torch.zeros_like(self.timeout_buf))
         
         # compute observations, rewards, resets, ...
-        self.post_physics_step()
+        with self.profiler.scope("post_physics_step"):
+            self.post_physics_step()
 
         # randomize observations
         if self.dr_randomizations.get('observations', None):
             self.obs_buf = self.dr_randomizations['observations']['noise_lambda'](self.obs_buf)
 
+        if self.static_step_buffers:
+            self._write_static_outputs()
+            if self.num_states > 0:
+                self.obs_dict["states"] = self.get_state()
+            return self.obs_dict, self._rl_rew_buf, self._rl_reset_buf, self.extras
+
         self.extras["time_outs"] = self.timeout_buf.to(self.rl_device)
 
         self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
@@ -399,11 +460,18 @@ class VecTask(Env):
         Returns:
             Observation dictionary, indices of environments being reset
         """
-        done_env_ids = self.reset_buf.nonzero(as_tuple=False).flatten()
-        if len(done_env_ids) > 0:
-            self.reset_idx(done_env_ids)
-
-        self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
+        with self.profiler.scope("reset_done"):
+            done_env_ids = self.reset_buf.nonzero(as_tuple=False).flatten()
+            if len(done_env_ids) > 0:
+                self.reset_idx(done_env_ids)
+
+        if self.static_step_buffers:
+            torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs, out=self._clipped_obs_buf)
+            if self._rl_obs_buf is not self._clipped_obs_buf:
+                self._rl_obs_buf.copy_(self._clipped_obs_buf)
+            self.obs_dict["obs"] = self._rl_obs_buf
+        else:
+            self.obs_dict["obs"] = torch.clamp(self.obs_buf, -self.clip_obs, self.clip_obs).to(self.rl_device)
 
         # asymmetric actor-critic
         if self.num_states > 0:
@@ -0,0 +1,175 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Allocation counts of the steady-state step with staticStepBuffers enabled, needs a GPU and the task assets.
+#
+#   python -m pytest tests/test_step_allocations.py
+#
+# Every task runs in its own process, a second sim in the same process is not reliable.
+# After warm-up, the whole step (action clipping, pre_physics_step, the task terms replayed from their
+# CUDA graph, timeout and output buffers) must not request a single block from the caching allocator,
+# must not reserve new device memory and the returned tensors must stay the same buffers.
+
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+TASKS = ["AtlasAMP", "CommonRigAMP"]
+
+
+def register_resolvers():
+    from omegaconf import OmegaConf
+
+    # same resolvers as train.py
+    OmegaConf.register_new_resolver('eq', lambda x, y: x.lower()==y.lower())
+    OmegaConf.register_new_resolver('contains', lambda x, y: x.lower() in y.lower())
+    OmegaConf.register_new_resolver('if', lambda pred, a, b: a if pred else b)
+    OmegaConf.register_new_resolver('resolve_default', lambda default, arg: default if arg=='' else arg)
+    return
+
+
+def create_task(task_name, num_envs, device):
+    from hydra import compose, initialize
+    from utils.reformat import omegaconf_to_dict
+    from tasks import isaacgym_task_map
+
+    register_resolvers()
+    with initialize(config_path="../cfg"):
+        cfg = compose(config_name="config", overrides=["task={:s}".format(task_name), "num_envs={:d}".format(num_envs),
+                                                       "sim_device={:s}".format(device), "rl_device={:s}".format(device),
+                                                       "headless=True"])
+
+    task_cfg = omegaconf_to_dict(cfg.task)
+    task_cfg["env"]["staticStepBuffers"] = True
+    # randomization reassigns the observation buffer, the step terms then run eagerly
+    task_cfg["task"]["randomize"] = False
+    # the pool refills from a background stream, its allocations do not belong to the step
+    task_cfg["env"]["refStatePool"] = False
+    # no resets inside the measured window, reset_done is not part of step
+    task_cfg["env"]["enableEarlyTermination"] = False
+    task_cfg["env"]["episodeLength"] = 100000
+
+    return isaacgym_task_map[task_name](cfg=task_cfg, sim_device=device, graphics_device_id=0, headless=True)
+
+
+def num_allocations(device):
+    import torch
+    return torch.cuda.memory_stats(device)["allocation.all.allocated"]
+
+
+def num_segments(device):
+    import torch
+    return torch.cuda.memory_stats(device)["segment.all.allocated"]
+
+
+def check_task(task_name, num_envs, device, warmup_steps, steps):
+    import isaacgym
+    import torch
+
+    env = create_task(task_name, num_envs, device)
+    env.reset()
+    env.reset_done()
+
+    assert env._step_terms_graph is not None, "{:s} does not replay its step terms from a graph".format(task_name)
+
+    actions = torch.zeros((num_envs, env.num_actions), device=device, dtype=torch.float)
+    for _ in range(warmup_steps):
+        actions.uniform_(-1.0, 1.0)
+        env.step(actions)
+    torch.cuda.synchronize(device)
+
+    obs_dict, rew, reset, extras = env.step(actions)
+    outputs = [obs_dict["obs"], rew, reset, extras["time_outs"], env.actions]
+    output_ptrs = [t.data_ptr() for t in outputs]
+
+    start_allocations = num_allocations(device)
+    start_segments = num_segments(device)
+    for _ in range(steps):
+        actions.uniform_(-1.0, 1.0)
+        obs_dict, rew, reset, extras = env.step(actions)
+    torch.cuda.synchronize(device)
+
+    step_allocations = num_allocations(device) - start_allocations
+    new_segments = num_segments(device) - start_segments
+    outputs = [obs_dict["obs"], rew, reset, extras["time_outs"], env.actions]
+
+    print("{:s}: {:d} step allocations, {:d} new segments over {:d} steps".format(
+        task_name, step_allocations, new_segments, steps))
+
+    assert step_allocations == 0, "{:s} step allocated {:d} tensors".format(task_name, step_allocations)
+    assert new_segments == 0, "{:s} step reserved {:d} new segments".format(task_name, new_segments)
+    assert [t.data_ptr() for t in outputs] == output_ptrs, "{:s} step outputs were reallocated".format(task_name)
+    return
+
+
+def run_task(task_name):
+    pytest.importorskip("isaacgym")
+    torch = pytest.importorskip("torch")
+    if (not torch.cuda.is_available()):
+        pytest.skip("needs a CUDA device")
+
+    cmd = [sys.executable, os.path.abspath(__file__), "--task", task_name]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    return
+
+
+def test_atlas_amp():
+    run_task("AtlasAMP")
+    return
+
+
+def test_common_rig_amp():
+    run_task("CommonRigAMP")
+    return
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Allocation counts of the steady-state env step")
+    parser.add_argument("--task", type=str, required=True, choices=TASKS)
+    parser.add_argument("--num_envs", type=int, default=64)
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--warmup_steps", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=100)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    check_task(args.task, args.num_envs, args.device, args.warmup_steps, args.steps)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# Copyright (c) 2018-2022, NVIDIA Corporation
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+
+class _NullScope():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+class _Scope():
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+        return
+
+    def __enter__(self):
+        self._start = self._profiler._mark()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler._records.append((self._name, self._start, self._profiler._mark()))
+        return False
+
+
+class StepProfiler():
+    """ Named timing scopes for the env step and the training loop.
+
+    On a GPU every scope records a pair of CUDA events so timing does not stall the stream,
+    the events are only resolved in collect(), once per epoch. On CPU wall clocks are used.
+    A disabled profiler hands out a shared no-op scope.
+
+        with profiler.scope("simulate"):
+            gym.simulate(sim)
+    """
+    def __init__(self, device="cpu", enabled=False, trace_file=None, trace_epochs=10):
+        self.enabled = enabled
+        self._use_cuda = enabled and torch.device(device).type == "cuda"
+        self._device = device
+
+        self._records = []
+        self._event_pool = []
+        self._event_count = 0
+        self._ref_event = None
+        self._ref_time = 0.0
+        self._origin = time.perf_counter()
+
+        self._trace_file = trace_file
+        self._trace_epochs = trace_epochs
+        self._trace_events = []
+        self._epoch = 0
+        return
+
+    def scope(self, name):
+        if (not self.enabled):
+            return _NULL_SCOPE
+        return _Scope(self, name)
+
+    def collect(self):
+        """ Resolves every scope recorded since the last call, returns {name: durations in ms}. """
+        durations = dict()
+        if (not self.enabled or len(self._records) == 0):
+            return durations
+
+        if (self._use_cuda):
+            torch.cuda.synchronize(self._device)
+
+        tracing = self._trace_file and self._epoch < self._trace_epochs
+        for name, start, end in self._records:
+            if (self._use_cuda):
+                start_ms = self._ref_event.elapsed_time(start)
+                dur_ms = start.elapsed_time(end)
+                ts_us = (self._ref_time - self._origin) * 1e6 + start_ms * 1e3
+            else:
+                dur_ms = (end - start) * 1e3
+                ts_us = (start - self._origin) * 1e6
+
+            durations.setdefault(name, []).append(dur_ms)
+            if (tracing):
+                self._trace_events.append({"name": name, "ph": "X", "ts": ts_us, "dur": dur_ms * 1e3,
+                                           "pid": 0, "tid": 0})
+
+        self._records = []
+        self._event_count = 0
+        self._ref_event = None
+
+        self._epoch += 1
+        if (tracing and self._epoch == self._trace_epochs):
+            self.export_chrome_trace(self._trace_file)
+
+        for name in durations:
+            durations[name] = np.array(durations[name])
+        return durations
+
+    def write_tensorboard(self, writer, frame, durations):
+        # per-call histograms plus the time each scope took over the whole epoch
+        for name, dur in durations.items():
+            writer.add_histogram('profile/' + name, dur, frame)
+            writer.add_scalar('profile_ms/' + name, np.sum(dur), frame)
+        return
+
+    def export_chrome_trace(self, trace_file):
+        trace_dir = os.path.dirname(os.path.abspath(trace_file))
+        os.makedirs(trace_dir, exist_ok=True)
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": self._trace_events, "displayTimeUnit": "ms"}, f)
+        print("Saved step profile trace to {:s}".format(trace_file))
+        return
+
+    def _mark(self):
+        if (not self._use_cuda):
+            return time.perf_counter()
+
+        if (self._ref_event is None):
+            # the stream is idle after collect(), so the host clock lines up with the reference event
+            torch.cuda.synchronize(self._device)
+            self._ref_event = self._next_event()
+            self._ref_event.record()
+            self._ref_time = time.perf_counter()
+
+        event = self._next_event()
+        event.record()
+        return event
+
+    def _next_event(self):
+        if (self._event_count == len(self._event_pool)):
+            self._event_pool.append(torch.cuda.Event(enable_timing=True))
+        event = self._event_pool[self._event_count]
+        self._event_count += 1
+        return event
+
+
+# shared by envs that are not driven by an agent with profiling enabled
+NULL_PROFILER = StepProfiler(enabled=False)
@@ -147,6 +147,11 @@ class RLGPUAlgoObserver(AlgoObserver):
             self.writer.add_scalar(f'{k}/iter', v, epoch_num)
             self.writer.add_scalar(f'{k}/time', v, total_time)
 
+        # per epoch counters of the env restart once they are logged
+        env = self.algo.vec_env.env
+        if hasattr(env, 'reset_termination_counts'):
+            env.reset_termination_counts()
+
         if self.mean_scores.current_size > 0:
             mean_scores = self.mean_scores.get_mean()
             self.writer.add_scalar('scores/mean', mean_scores, frame)